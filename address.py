@@ -0,0 +1,178 @@
+# Address canonicalization and hierarchical geocoding fallback
+# An address is a list of (level, value) pairs from the most specific level to the
+# least specific one, e.g. [('xa', 'Xã Mỹ Hòa'), ('huyen', 'Chợ Mới'), ('tinh', 'An Giang')].
+# The cache key of an address ignores case, spacing, diacritics, administrative
+# prefixes ("Xã", "Phường", "Huyện", ...) and empty or "nan" components, so the same
+# place spelled differently is geocoded only once. Prefixes are matched with their
+# diacritics, before those are removed, so names such as "Tịnh Biên" or "Quan Sơn" keep
+# their first syllable.
+
+import re
+import time
+import unicodedata
+import pandas as pd
+from geocoder import GeocodingCancelled, GeocodingError
+from geocache import NOT_FOUND
+
+# Administrative levels, from the most specific to the least specific
+LEVELS = ('ap', 'xa', 'huyen', 'tinh')
+
+# Administrative prefixes removed from the cache key (lower case NFC, with their diacritics)
+ADMIN_PREFIXES = ('thành phố', 'thị trấn', 'thị xã', 'khu phố', 'phường', 'huyện', 'quận', 'tỉnh', 'khóm',
+                  'xã', 'ấp', 'tp', 'tt', 'tx', 'kp', 'tổ', 'p', 'q', 'h')
+_PREFIX = re.compile(r'^(?:%s)\.?\s+(?=\S)' % '|'.join(ADMIN_PREFIXES))
+_COUNTRY = ('viet nam', 'vietnam')
+
+def clean_component(value):
+    """Return the display form of an address component: trimmed, NFC, '' for missing values or 'nan'."""
+    if value is None or value != value:  # None or NaN
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = unicodedata.normalize('NFC', ' '.join(str(value).split()))
+    return '' if value.lower() in ('nan', 'none', 'null') else value
+
+def canonical_component(value):
+    """Return the cache-key form of an address component: lower case, no diacritics, no prefix or punctuation."""
+    value = _PREFIX.sub('', unicodedata.normalize('NFC', clean_component(value).lower()))
+    value = unicodedata.normalize('NFD', value.replace('đ', 'd'))
+    value = ''.join(char for char in value if unicodedata.category(char) != 'Mn')
+    return ' '.join(re.sub(r'[^\w\s]', ' ', value).split())
+
+def address_parts(ap='', xa='', huyen='', tinh=''):
+    """Build an address from its administrative components, skipping the empty ones."""
+    parts = zip(LEVELS, (ap, xa, huyen, tinh))
+    return [(level, clean_component(value)) for level, value in parts if clean_component(value)]
+
+def split_address(text):
+    """Build an address from comma-separated text such as 'Xa, Huyen, Tinh, Việt Nam'.
+
+    Components are assigned to levels from the end (the last one is the province);
+    anything more specific than a hamlet gets the level 'detail'.
+    """
+    values = [clean_component(value) for value in str(text).split(',')]
+    values = [value for value in values if value and canonical_component(value) not in _COUNTRY]
+    levels = ('detail',) * max(0, len(values) - len(LEVELS)) + LEVELS[-len(values):] if values else ()
+    return list(zip(levels, values))
+
+def canonical_key(parts):
+    """Cache key of an address: its canonical components from the province down, joined by '|'."""
+    return '|'.join(canonical_component(value) for _, value in reversed(parts))
+
+def format_address(parts):
+    """Query string of an address for the geocoder."""
+    return ', '.join([value for _, value in parts] + ['Việt Nam'])
+
+def fallback_chain(parts):
+    """The address itself, then each less specific address obtained by dropping its first component."""
+    return [parts[number:] for number in range(len(parts))]
+
+def geocode_with_fallback(parts, geocode, cache, gazetteer=None):
+    """Geocode an address, falling back to less specific levels until one resolves.
+
+    geocode(query) returns an object with latitude/longitude or None, and may raise
+    GeocodingError. At each level the cache is checked first, then the offline gazetteer
+    (if any), and only then geocode. Every level tried is cached with the coordinates
+    found and the level that resolved them, so the next address sharing any of those
+    levels needs no network call. Only a level that is not found falls back: when a
+    request fails (or failed recently), GeocodingError is raised, so the address is tried
+    again later instead of resolving to a coarser level for good. When no level resolves,
+    the levels not found are recorded as failures. Returns (latitude, longitude, level),
+    or None when the address is not found at any level.
+    """
+    tried = []
+    not_found = []
+    result = None
+    error = None
+    for candidate in fallback_chain(parts):
+        key = canonical_key(candidate)
+        result = cache.lookup(key) or (gazetteer.lookup(key) if gazetteer else None)
+        if result:
+            break
+
+        reason = cache.failure(key)
+        if reason == NOT_FOUND:
+            tried.append(key)
+            continue
+        if reason:
+            # A recent request error: wait for it to expire rather than fall back
+            error = GeocodingError(reason)
+            break
+
+        query = format_address(candidate)
+        try:
+            location = geocode(query)
+        except GeocodingError as e:
+            # Transient: remembered only for the error TTL, and no coarser level is tried
+            cache.put_failure(key, str(e), query, ttl=cache.error_ttl)
+            error = e
+            break
+        if location:
+            result = (float(location.latitude), float(location.longitude), candidate[0][0])
+            cache.put(key, *result)
+            break
+        tried.append(key)
+        not_found.append((key, query))
+
+    if result:
+        for key in tried:
+            cache.put(key, *result)
+    else:
+        for key, query in not_found:
+            cache.put_failure(key, NOT_FOUND, query)
+    if error:
+        raise error
+    return result
+
+def geocode_unique(df, columns, build_parts, geocode, cache, rate_limit=None, should_stop=None, mapper=map,
+                   gazetteer=None):
+    """Geocode every distinct address of df once and broadcast the results to all its rows.
+
+    build_parts turns the values of columns into an address (e.g. address_parts or
+    split_address). Only the queries that reach the geocoder wait for the rate limit,
+    so addresses already in the cache cost nothing. should_stop is checked before each
+    new address. Pass a GeocodingEngine's geocode and map (and no rate_limit) to resolve
+    the addresses concurrently under the engine's own rate limiter, and a Gazetteer to
+    resolve known communes, districts and provinces offline.
+
+    Returns a DataFrame indexed like df with the columns geocode_query, latitude,
+    longitude and geocode_level, which are NaN where the address was not resolved.
+    """
+    if rate_limit:
+        unlimited = geocode
+        def geocode(query):
+            time.sleep(1 / rate_limit)
+            return unlimited(query)
+
+    def resolve(parts):
+        if should_stop and should_stop():
+            return None
+        try:
+            return geocode_with_fallback(parts, geocode, cache, gazetteer)
+        except (GeocodingCancelled, GeocodingError):
+            return None
+
+    # Distinct raw values can still share one canonical address
+    distinct = []
+    addresses = {}
+    for values in df[columns].drop_duplicates().itertuples(index=False, name=None):
+        parts = build_parts(*values)
+        key = canonical_key(parts)
+        addresses.setdefault(key, parts)
+        distinct.append((values, parts, key))
+    results = dict(zip(addresses, mapper(resolve, addresses.values())))
+
+    rows = []
+    for values, parts, key in distinct:
+        geocoded = results.get(key) or (float('nan'), float('nan'), None)
+        rows.append(values + (format_address(parts),) + tuple(geocoded))
+
+    outputs = ['geocode_query', 'latitude', 'longitude', 'geocode_level']
+    if df.empty:
+        # Nothing to merge (the key columns of an empty frame may not even share its dtypes)
+        return pd.DataFrame({'geocode_query': pd.Series(dtype=object), 'latitude': pd.Series(dtype=float),
+                             'longitude': pd.Series(dtype=float), 'geocode_level': pd.Series(dtype=object)}, index=df.index)
+    table = pd.DataFrame(rows, columns=list(columns) + outputs)
+    geocoded = df[columns].merge(table, on=list(columns), how='left')
+    geocoded.index = df.index
+    return geocoded[outputs]
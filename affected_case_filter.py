@@ -1,64 +1,151 @@
 import pandas as pd
-import sys
+import argparse
 import os
 #from datetime import datetime
 
-def main(affected_regions_file, original_file, output_file):
-    # Load the affected regions CSV file with with date parsing
-    affected_df = pd.read_csv(affected_regions_file)
-    affected_df['Year'] = affected_df['Year'].astype(int)
+# Admin-unit columns of a rule -> column of the cases they match, from the widest to the narrowest
+RULE_LEVELS = {
+    'Affected_Province': 'Tinh',
+    'Affected_District': 'Huyen',
+    'Affected_Commune': 'Xa',
+}
 
-    # Load the original dataframe with date parsing
+# Rows read at a time by the streaming mode
+DEFAULT_CHUNK_SIZE = 100000
+
+# Function to convert a column to datetimes, invalid parsing will be set as NaT
+# Dates repeat a lot, so each distinct value is parsed once (in order of appearance, so the
+# format is inferred from the same first value as when parsing the whole column)
+def parse_dates(series):
+    codes, uniques = pd.factorize(series)
+    parsed = pd.to_datetime(pd.Series(uniques, dtype=object), errors='coerce')
+    return pd.Series(parsed.to_numpy()[codes], index=series.index).where(codes >= 0)
+
+# Function to add the 'Year' of the cases, the year of the later of 'VaoVien' and 'RaVien'
+def add_case_year(cases):
+    cases['VaoVien'] = parse_dates(cases['VaoVien'])
+    cases['RaVien'] = parse_dates(cases['RaVien'])
+    cases['Year'] = cases[['VaoVien', 'RaVien']].max(axis=1).dt.year
+    return cases
+
+# Function to load the cases and add their 'Year', the year of the later of 'VaoVien' and 'RaVien'
+def load_cases(original_file):
+    # Load the original dataframe (read_csv already reads empty cells as missing values)
     original_df = pd.read_csv(original_file)
+    return add_case_year(original_df)
+
+# Function to load the rules: one admin unit per row (Affected_Province, and optionally
+# Affected_District and Affected_Commune) with the period of the cases it selects, either
+# up to a 'Year' (included) or between 'Start' and 'End' dates (both included, either blank)
+def load_rules(affected_regions_file):
+    affected_df = pd.read_csv(affected_regions_file, encoding='utf-8-sig')
+    if 'Year' in affected_df.columns:
+        affected_df['Year'] = pd.to_numeric(affected_df['Year'], errors='coerce').astype('Int64')
+    for column in ('Start', 'End'):
+        if column in affected_df.columns:
+            affected_df[column] = pd.to_datetime(affected_df[column], errors='coerce')
+    return affected_df
+
+def filter_affected(cases, rules, dedupe=False):
+    """Return the cases matching any rule, as one hash join per admin level of the rules.
+
+    The rows come out rule by rule, in the order of the rules and then of the cases, so a
+    case matching several rules appears once per rule, unless dedupe is set (it is then
+    kept at its first rule). cases needs the columns matched by the rules, 'Year' for the
+    rules with a Year, and 'VaoVien' and 'RaVien' for the rules with a Start or an End.
+    """
+    rules = rules.reset_index(drop=True).assign(_rule=lambda df: df.index)
+    rule_columns = [column for column in RULE_LEVELS if column in rules.columns]
+
+    # The date of a case is the later of its admission and discharge dates
+    if 'Start' in rules.columns or 'End' in rules.columns:
+        dates = cases[['VaoVien', 'RaVien']].max(axis=1)
+
+    matches = []
+    # Rules naming the same admin levels are joined together
+    levels = rules[rule_columns].notna()
+    for level, group in rules.groupby([levels[column] for column in rule_columns], sort=False):
+        keys = [column for column, named in zip(rule_columns, level) if named]
+        if not keys:
+            continue
+        case_keys = [RULE_LEVELS[column] for column in keys]
+        # Compared as Python objects (categories are kept), so a numeric or empty column simply matches nothing
+        left = cases[case_keys].astype({key: object for key in case_keys if cases[key].dtype != 'category'})
+        left = left.assign(_row=range(len(cases)))
+        joined = group.astype({key: object for key in keys}).merge(left, left_on=keys, right_on=case_keys, how='inner')
+        row = joined['_row'].to_numpy()
+
+        # Period of each rule, evaluated for all the joined rows at once
+        keep = pd.Series(True, index=joined.index)
+        if 'Year' in joined.columns:
+            years = cases['Year'].to_numpy()[row]
+            keep &= joined['Year'].isna().to_numpy() | (years <= joined['Year'].to_numpy(dtype=float, na_value=float('nan')))
+        if 'Start' in joined.columns:
+            keep &= joined['Start'].isna().to_numpy() | (dates.to_numpy()[row] >= joined['Start'].to_numpy())
+        if 'End' in joined.columns:
+            # End is a day: every time of that day is included
+            end = joined['End'] + pd.Timedelta(days=1)
+            keep &= joined['End'].isna().to_numpy() | (dates.to_numpy()[row] < end.to_numpy())
+        matches.append(joined.loc[keep, ['_rule', '_row']])
+
+    if not matches:
+        return cases.iloc[[]]
+    matched = pd.concat(matches).sort_values(['_rule', '_row'], kind='stable')
+    if dedupe:
+        matched = matched.drop_duplicates('_row')
+    return cases.iloc[matched['_row'].to_numpy()]
+
+def stream_affected(affected_df, original_file, output_file, dedupe=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Filter the cases chunk by chunk, appending the matching rows of each chunk to output_file.
+
+    Only the columns of the rules' admin levels (as categories) and the two dates are parsed;
+    the other columns are read as text and written back unchanged, followed by 'Year'. Rows
+    come out chunk by chunk, in rule order within a chunk. Returns the number of rows written.
+    """
+    keys = [RULE_LEVELS[column] for column in RULE_LEVELS if column in affected_df.columns]
+    count = 0
+    with open(output_file, 'w', newline='', encoding='utf-8') as f:
+        reader = pd.read_csv(original_file, dtype=str, keep_default_na=False, chunksize=chunk_size)
+        for number, chunk in enumerate(reader):
+            # The predicate columns of the chunk, with the chunk's row labels
+            cases = chunk[keys].astype('category').where(chunk[keys] != '')
+            cases['VaoVien'] = chunk['VaoVien']
+            cases['RaVien'] = chunk['RaVien']
+            matched = filter_affected(add_case_year(cases), affected_df, dedupe)
+
+            rows = chunk.loc[matched.index].assign(Year=matched['Year'].astype('Int64'))
+            rows.to_csv(f, header=number == 0, index=False)
+            count += len(rows)
+    return count
+
+def main(affected_regions_file, original_file, output_file, dedupe=False, stream=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Load the affected regions CSV file and the cases with their year
+    affected_df = load_rules(affected_regions_file)
+    if stream:
+        count = stream_affected(affected_df, original_file, output_file, dedupe, chunk_size)
+        print(f"Filtered data ({count} rows) has been saved to {output_file}")
+        return
+    original_df = load_cases(original_file)
+
+    # Join the cases to the rules of their admin units and keep the ones in the rules' periods
+    final_filtered_df = filter_affected(original_df, affected_df, dedupe)
 
-    # Replace empty strings with NaT
-    original_df.replace('', pd.NaT, inplace=True)
-
-    # Convert columns to datetime, invalid parsing will be set as NaT
-    original_df['VaoVien'] = pd.to_datetime(original_df['VaoVien'], errors='coerce')
-    original_df['RaVien'] = pd.to_datetime(original_df['RaVien'], errors='coerce')
-
-    # Create a new column with the greater date
-    original_df['Year'] = original_df[['VaoVien', 'RaVien']].max(axis=1)
-
-    # Extract the year from the date in the original dataframe
-    original_df['Year'] = original_df['Year'].dt.year
-
-
-    # Create a list to hold the filtered data
-    filtered_data = []
-
-    # Iterate over each row in the affected regions dataframe
-    for _, affected_row in affected_df.iterrows():
-        affected_district = affected_row['Affected_District']
-        affected_province = affected_row['Affected_Province']
-        affected_year = affected_row['Year']
-        
-        # Filter the original dataframe
-        filtered_df = original_df[
-            (original_df['Huyen'] == affected_district) &
-            (original_df['Tinh'] == affected_province) &
-            (original_df['Year'] <= affected_year)
-        ]
-        
-        # Append the filtered rows to the list
-        filtered_data.append(filtered_df)
-
-    # Concatenate all the filtered data into a single dataframe
-    final_filtered_df = pd.concat(filtered_data)
-   
     # Save the filtered dataframe to the new CSV file
     final_filtered_df.to_csv(output_file, index=False)
 
     print(f"Filtered data has been saved to {output_file}")
 
 if __name__ == '__main__':
-    if len(sys.argv) != 4:
-        print("Usage: python affected_case_filter.py <affected_regions_file> <original_file> <output_file>")
-    else:
-        affected_regions_file = sys.argv[1]
-        original_file = sys.argv[2]        
-        # Generate the output filename based on the input filename
-        output_file = os.path.splitext(original_file)[0] + "_affected.csv"
-
-        main(affected_regions_file, original_file, output_file)
+    parser = argparse.ArgumentParser(description="Select the cases of the affected admin units and periods.")
+    parser.add_argument('affected_regions_file', help="CSV of Year (or Start/End), Affected_District, Affected_Province (and Affected_Commune) rules.")
+    parser.add_argument('original_file', help="CSV of the cases.")
+    parser.add_argument('output_file', nargs='?', default=None, help="Output CSV (default: <original_file>_affected.csv).")
+    parser.add_argument('--dedupe', action='store_true', help="Keep a case matching several rules only once.")
+    parser.add_argument('--stream', action='store_true', help="Read the cases in chunks, so memory does not grow with the file size.")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per chunk of --stream.")
+    args = parser.parse_args()
+
+    # Generate the output filename based on the input filename
+    output_file = args.output_file or os.path.splitext(args.original_file)[0] + "_affected.csv"
+
+    main(args.affected_regions_file, args.original_file, output_file, args.dedupe, args.stream, args.chunk_size)
@@ -0,0 +1,123 @@
+# Spatial and temporal queries over the case features written by xls2geojson.py
+# ensure_indexes creates the indexes the queries rely on: 2dsphere on geometry, admin units
+# (province, district, commune) with the admission date, and the admission date alone.
+# Every filter is evaluated by the server: find_cases streams the matching features from a
+# cursor, cases_dataframe flattens them into a DataFrame, and count_cases groups and counts
+# them in an aggregation pipeline, so a dashboard only fetches what it draws.
+# Admission dates (properties.meta.VaoVien) are stored as ISO 8601 strings, which sort in
+# date order, so date ranges are string ranges. A missing date is stored as '' (see
+# linelist.normalize_dates), which sorts first: date filters and periods leave it out.
+
+from datetime import date, datetime
+import pandas as pd
+from pymongo import ASCENDING, GEOSPHERE
+
+# Mean Earth radius (IUGG) in metres, to turn a radius into the radians of $centerSphere
+EARTH_RADIUS = 6371008.8
+
+# Fields of the admin-unit levels and of the admission date
+ADDRESS_LEVELS = ('properties.address.level1', 'properties.address.level2', 'properties.address.level3')
+DATE_FIELD = 'properties.meta.VaoVien'
+
+# Columns of cases_dataframe: column name -> field of the feature
+CASE_COLUMNS = {
+    'patient_id': 'properties.patient.id',
+    'level1': 'properties.address.level1',
+    'level2': 'properties.address.level2',
+    'level3': 'properties.address.level3',
+    'geocode_level': 'properties.address.geocode_level',
+    'VaoVien': 'properties.meta.VaoVien',
+    'NgayKB': 'properties.meta.NgayKB',
+    'CDRaVien': 'properties.meta.CDRaVien',
+}
+
+# Period of count_cases -> length of the ISO date prefix it groups on
+PERIODS = {'year': 4, 'month': 7, 'day': 10}
+
+def ensure_indexes(collection):
+    """Create the indexes used by the queries (a no-op for the ones that already exist)."""
+    collection.create_index([('geometry', GEOSPHERE)], name='geometry_2dsphere')
+    collection.create_index([(field, ASCENDING) for field in ADDRESS_LEVELS + (DATE_FIELD,)], name='admin_units_date')
+    collection.create_index([(DATE_FIELD, ASCENDING)], name='date')
+
+def _date_value(value):
+    """The stored (ISO string) form of a date, datetime or string."""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+def build_filter(bbox=None, center=None, radius=None, level1=None, level2=None, level3=None, start=None, end=None):
+    """Build the query document of the case filters; the ones left to None are not applied.
+
+    bbox is (min_longitude, min_latitude, max_longitude, max_latitude), center is
+    (longitude, latitude) with radius in metres, level1/level2/level3 are the province,
+    district and commune names, and start/end bound the admission date (end excluded);
+    cases without an admission date never match a date bound.
+    """
+    query = {}
+    if bbox is not None:
+        west, south, east, north = bbox
+        ring = [[west, south], [east, south], [east, north], [west, north], [west, south]]
+        query['geometry'] = {'$geoWithin': {'$geometry': {'type': 'Polygon', 'coordinates': [ring]}}}
+    if center is not None:
+        if radius is None:
+            raise ValueError("A center needs a radius")
+        query.setdefault('$and', []).append(
+            {'geometry': {'$geoWithin': {'$centerSphere': [list(center), radius / EARTH_RADIUS]}}})
+    for field, value in zip(ADDRESS_LEVELS, (level1, level2, level3)):
+        if value is not None:
+            query[field] = value
+    if start is not None or end is not None:
+        query[DATE_FIELD] = {}
+        if start is not None:
+            query[DATE_FIELD]['$gte'] = _date_value(start)
+        else:
+            # '' (no date) sorts before every date
+            query[DATE_FIELD]['$gt'] = ''
+        if end is not None:
+            query[DATE_FIELD]['$lt'] = _date_value(end)
+    return query
+
+def find_cases(collection, projection=None, batch_size=1000, **filters):
+    """Return a cursor streaming the features matching the filters of build_filter."""
+    return collection.find(build_filter(**filters), projection, batch_size=batch_size)
+
+def _field(document, path):
+    for key in path.split('.'):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(key)
+    return document
+
+def cases_dataframe(collection, columns=CASE_COLUMNS, **filters):
+    """Return the features matching the filters as a DataFrame with longitude, latitude and the given columns."""
+    projection = {field: 1 for field in columns.values()}
+    projection.update({'geometry.coordinates': 1, '_id': 0})
+    rows = []
+    for feature in find_cases(collection, projection, **filters):
+        coordinates = _field(feature, 'geometry.coordinates') or [None, None]
+        rows.append([coordinates[0], coordinates[1]] + [_field(feature, field) for field in columns.values()])
+    return pd.DataFrame(rows, columns=['longitude', 'latitude'] + list(columns))
+
+def count_cases(collection, by=('level1',), period='month', **filters):
+    """Count the features matching the filters per admin unit and period, on the server.
+
+    by names the admin-unit levels to group on (level1, level2, level3), period is
+    'year', 'month', 'day' or None. Returns a DataFrame with one column per level, a
+    'period' column (the ISO date prefix) and a 'cases' column. With a period, the
+    cases without an admission date are not counted.
+    """
+    group = {level: '$' + ADDRESS_LEVELS[int(level[-1]) - 1] for level in by}
+    if period:
+        # $substr (alias of $substrBytes) is also understood by mongomock; ISO dates are ASCII
+        group['period'] = {'$substr': ['$' + DATE_FIELD, 0, PERIODS[period]]}
+    match = build_filter(**filters)
+    if period:
+        match.setdefault(DATE_FIELD, {'$gt': ''})
+    pipeline = [
+        {'$match': match},
+        {'$group': {'_id': group, 'cases': {'$sum': 1}}},
+        {'$sort': {'_id': 1}},
+    ]
+    rows = [dict(result['_id'], cases=result['cases']) for result in collection.aggregate(pipeline)]
+    return pd.DataFrame(rows, columns=list(group) + ['cases'])
@@ -1,16 +1,15 @@
 import geopandas as gpd
 import matplotlib.pyplot as plt
-import json
 from matplotlib.widgets import Slider, RadioButtons
 import matplotlib.colors as mcolors
 import numpy as np
 import calendar
+from geojsonstream import iter_features
 
-# Function to load and process the GeoJSON file
+# Function to load the features of a GeoJSON file (FeatureCollection or GeoJSONSeq, optionally gzipped)
+# one at a time, without holding the whole document in memory
 def load_geojson(file_path):
-    with open(file_path, 'r', encoding='utf-8') as f:
-        geojson_data = json.load(f)
-    return geojson_data
+    return iter_features(file_path)
 
 # Function to create a color map based on dengue cases with enhanced contrast
 def get_color_map(max_cases):
@@ -19,9 +18,9 @@ def get_color_map(max_cases):
     return cmap, norm
 
 # Function to plot dengue cases over time with options to compare by month, year, and total by month across all years
-def plot_dengue_cases(geojson_data):
-    # Convert the GeoJSON into a GeoDataFrame
-    gdf = gpd.GeoDataFrame.from_features(geojson_data['features'])
+def plot_dengue_cases(features):
+    # Convert the GeoJSON features into a GeoDataFrame
+    gdf = gpd.GeoDataFrame.from_features(features)
 
     # Calculate the maximum number of cases in any single year and overall for color mapping
     #yearly_max_cases = max(max(sum(c[0] for c in year_data.values())) for year_data in gdf['total_cases'])
@@ -123,10 +122,10 @@ def plot_dengue_cases(geojson_data):
 def main():
     # Load the GeoJSON file
     geojson_file = "ED_MDR_Dengue_Level3_Data_2000_2023_merged.geojson"
-    geojson_data = load_geojson(geojson_file)
+    features = load_geojson(geojson_file)
     
     # Plot dengue cases over time with comparison options
-    plot_dengue_cases(geojson_data)
+    plot_dengue_cases(features)
 
 if __name__ == "__main__":
     main()
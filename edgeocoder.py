@@ -1,17 +1,20 @@
 import pandas as pd
-import time
 import signal
 import sys
 import os
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
 import argparse
+from geocache import GeoCache, DEFAULT_CACHE_FILE, DEFAULT_FAILURE_TTL
+from address import split_address, geocode_with_fallback
+from geocoder import GeocodingEngine, GeocodingCancelled, GeocodingError
+from gazetteer import load_gazetteer, DEFAULT_GAZETTEER_FILE
+from journal import Journal
 
-# Configurable rate limit
+# Configurable rate limit and number of concurrent requests
 rate_limit_per_second = 1
+workers = 4
 
-# Initialize geolocator with user_agent
-geolocator = Nominatim(user_agent="geoapiExercises")
+# Initialize the geocoding engine (one shared geolocator and rate limiter) with user_agent
+geocoding_engine = GeocodingEngine(rate_limit_per_second, workers, user_agent="geoapiExercises")
 
 # Initialize success and fail counters
 success_count = 0
@@ -20,116 +23,134 @@ fail_count = 0
 # Flag to handle graceful shutdown
 stop_flag = False
 
+# Geocode cache shared with the other geocoders, opened in main
+geocache = None
+
+# Offline gazetteer of communes, districts and provinces, loaded in main
+gazetteer = None
+
+# Geocode an address, falling back to its less specific levels; returns latitude, longitude and the level used
+# ('NA' when the address is not found), or None when the request failed or was cancelled and should be retried
+# Only queries that miss both the cache and the gazetteer reach Nominatim, so only they are rate limited
 def geocode_address(address):
     try:
-        location = geolocator.geocode(address, timeout=10)
-        if location:
-            return location.latitude, location.longitude
-        else:
-            return 'NA', 'NA'
-    except GeocoderTimedOut:
-        return 'NA', 'NA'
+        geocoded = geocode_with_fallback(split_address(address), geocoding_engine.geocode, geocache, gazetteer)
+    except (GeocodingCancelled, GeocodingError):
+        return None
+    if geocoded:
+        return geocoded
+    return 'NA', 'NA', 'NA'
 
 def signal_handler(sig, frame):
     global stop_flag
     stop_flag = True
+    geocoding_engine.cancel()
     print("\nGracefully stopping the script. Please wait...")
 
 signal.signal(signal.SIGINT, signal_handler)
 
-def main(input_csv):
-    global success_count, fail_count, stop_flag
-
-    # Check for existing state file
-    state_file = 'geocoding_state.csv'
-    if os.path.exists(state_file):
-        try:
-            df = pd.read_csv(state_file)
-        except pd.errors.EmptyDataError:
-            print(f"Error: {state_file} is empty or corrupted.")
-            return
-        success_count = len(df[df['latitude'] != 'NA'])
-        fail_count = len(df[df['latitude'] == 'NA'])
-        start_index = df.index.max() + 1
-    else:
-        try:
-            df = pd.read_csv(input_csv)
-        except FileNotFoundError:
-            print(f"Error: File {input_csv} not found.")
-            return
-        except pd.errors.EmptyDataError:
-            print(f"Error: {input_csv} is empty or corrupted.")
-            return
-        except pd.errors.ParserError:
-            print(f"Error: File {input_csv} has an incorrect structure.")
-            return
-        
-        if 'address' not in df.columns:
-            print("Error: The input CSV file must contain an 'address' column.")
-            return
-
-        df['latitude'] = 'NA'
-        df['longitude'] = 'NA'
-        start_index = 0
-
-    # Iterate over rows in the DataFrame starting from last processed index
-    for index in range(start_index, len(df)):
-        if stop_flag:
-            break
-        lat, lon = geocode_address(df.at[index, 'address'])
-        df.at[index, 'latitude'] = lat
-        df.at[index, 'longitude'] = lon
-        if lat != 'NA' and lon != 'NA':
-            success_count += 1
-        else:
-            fail_count += 1
-        print(f"\rProcessed {index + 1}/{len(df)}: {success_count} successful, {fail_count} failed", end='')
-        time.sleep(1 / rate_limit_per_second)  # Rate limiting
-
-        # Save state periodically
-        if index % 10 == 0:
-            try:
-                df.to_csv(state_file, index=False)
-            except Exception as e:
-                print(f"\nError saving state file: {e}")
-                return
-
-    # Save state before exiting
+def main(input_csv, cache_file=DEFAULT_CACHE_FILE, gazetteer_file=DEFAULT_GAZETTEER_FILE, failure_ttl=DEFAULT_FAILURE_TTL,
+         retry_failures=False, failures_csv='geocode_failures.csv', output_csv='addresses_geocoded.csv',
+         failed_csv='addresses_failed.csv', journal_file=None):
+    global success_count, fail_count, stop_flag, geocache, gazetteer
+
+    # Addresses that failed within failure_ttl seconds are skipped unless retry_failures is set
+    geocache = GeoCache(cache_file, failure_ttl=failure_ttl, retry_failures=retry_failures)
+    gazetteer = load_gazetteer(gazetteer_file)
+
     try:
-        df.to_csv(state_file, index=False)
-    except Exception as e:
-        print(f"\nError saving state file: {e}")
+        df = pd.read_csv(input_csv)
+    except FileNotFoundError:
+        print(f"Error: File {input_csv} not found.")
+        return
+    except pd.errors.EmptyDataError:
+        print(f"Error: {input_csv} is empty or corrupted.")
+        return
+    except pd.errors.ParserError:
+        print(f"Error: File {input_csv} has an incorrect structure.")
         return
 
-    # Remove successfully geocoded addresses and save remaining to the original CSV
-    df_unsuccessful = df[df['latitude'] == 'NA'].drop(columns=['latitude', 'longitude'])
-    try:
-        df_unsuccessful.to_csv(input_csv, index=False)
-    except Exception as e:
-        print(f"\nError saving unsuccessful addresses: {e}")
+    if 'address' not in df.columns:
+        print("Error: The input CSV file must contain an 'address' column.")
+        return
+
+    # Object columns, since they mix coordinates with the 'NA' marker
+    for column in ('latitude', 'longitude', 'geocode_level'):
+        df[column] = pd.Series('NA', index=df.index, dtype=object)
+
+    # Replay the results journaled by a previous run on the same input
+    journal = Journal(journal_file or os.path.splitext(input_csv)[0] + '.journal.jsonl', input_csv)
+    done = set()
+    for record in journal.records:
+        df.loc[record['row'], ['latitude', 'longitude', 'geocode_level']] = [record['latitude'], record['longitude'], record['level']]
+        done.add(record['row'])
+    success_count = int((df['latitude'] != 'NA').sum())
+    fail_count = len(done) - success_count
+    if done:
+        print(f"Resuming: {len(done)} rows already geocoded")
+
+    # Iterate over the rows not journaled yet
+    # Rows are geocoded concurrently by the engine and come back in order
+    pending = [index for index in range(len(df)) if index not in done]
+    results = geocoding_engine.map(geocode_address, df['address'].iloc[pending])
+    retry_count = 0
+    for index, result in zip(pending, results):
+        if stop_flag:
+            break
+        # Only definitive results are journaled: a row whose request failed is retried by the next run
+        if result is None:
+            retry_count += 1
+        else:
+            lat, lon, level = result
+            df.at[index, 'latitude'] = lat
+            df.at[index, 'longitude'] = lon
+            df.at[index, 'geocode_level'] = level
+            journal.append({'row': index, 'latitude': lat, 'longitude': lon, 'level': level})
+            if lat != 'NA' and lon != 'NA':
+                success_count += 1
+            else:
+                fail_count += 1
+        print(f"\rProcessed {index + 1}/{len(df)}: {success_count} successful, {fail_count + retry_count} failed", end='')
+    journal.close()
+
+    if stop_flag:
+        print(f"\nStopped: {success_count + fail_count}/{len(df)} rows journaled to {journal.journal_file}, run again to resume")
         return
+    fail_count += retry_count
 
-    # Save the successful geocoded data to a new CSV
+    # Materialize the outputs once; the input CSV is left untouched
     df_successful = df[df['latitude'] != 'NA']
+    df_unsuccessful = df[df['latitude'] == 'NA'].drop(columns=['latitude', 'longitude', 'geocode_level'])
     try:
-        df_successful.to_csv('addresses_geocoded.csv', index=False)
+        df_successful.to_csv(output_csv, index=False)
+        df_unsuccessful.to_csv(failed_csv, index=False)
     except Exception as e:
         print(f"\nError saving geocoded addresses: {e}")
         return
+    journal.remove()
 
     # Print the final counts
     print(f"\nFinal count: {success_count} successful, {fail_count} failed")
 
-    # Clean up state file if processing completed
-    if not stop_flag:
-        try:
-            os.remove(state_file)
-        except OSError as e:
-            print(f"\nError removing state file: {e}")
+    # Report every address that failed to geocode, with its reason, so it can be fixed by hand
+    try:
+        print(f"{geocache.export_failures(failures_csv)} recorded failures saved to {failures_csv}")
+    except Exception as e:
+        print(f"\nError saving the failure report: {e}")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Geocode addresses from a CSV file.")
     parser.add_argument('input_csv', type=str, help="The input CSV file containing addresses.")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_FILE, help="The geocode cache database shared by all geocoders.")
+    parser.add_argument('--gazetteer', default=DEFAULT_GAZETTEER_FILE, help="The level-3 boundary GeoJSON used to geocode communes offline.")
+    parser.add_argument('--failure-ttl', type=float, default=DEFAULT_FAILURE_TTL / 86400, help="Days before an address that failed to geocode is tried again.")
+    parser.add_argument('--retry-failed', action='store_true', help="Try again the addresses that failed, even before their TTL expires.")
+    parser.add_argument('--failures', default='geocode_failures.csv', help="The CSV report of the addresses that failed to geocode.")
+    parser.add_argument('--output', default='addresses_geocoded.csv', help="The CSV file of the geocoded rows.")
+    parser.add_argument('--failed', default='addresses_failed.csv', help="The CSV file of the rows that could not be geocoded.")
+    parser.add_argument('--journal', default=None, help="The results journal used to resume (default: <input_csv>.journal.jsonl).")
     args = parser.parse_args()
 
-    main(args.input_csv)
+    main(args.input_csv, args.cache, args.gazetteer, args.failure_ttl * 86400, args.retry_failed, args.failures,
+         args.output, args.failed, args.journal)
@@ -0,0 +1,165 @@
+# Offline gazetteer built from the level-3 (commune) boundary GeoJSON
+# Every commune polygon is indexed under the canonical key of its (Xa, Huyen, Tinh)
+# names (see address.py), and every district and province under the key of its
+# (Huyen, Tinh) and (Tinh) names, so most case addresses are resolved from memory
+# without a network call. Each key maps to a representative point: the area centroid
+# of the polygons when it lies inside them, otherwise the middle of the widest
+# horizontal segment through the polygon at the centroid's latitude.
+
+import json
+import os
+from address import address_parts, canonical_key
+
+# Default boundary file (the one loaded by ed_visualise_3.py), can be overridden with ED_GAZETTEER
+DEFAULT_GAZETTEER_FILE = os.environ.get('ED_GAZETTEER', 'ED_MDR_Dengue_Level3_Data_2000_2023_merged.geojson')
+
+# Properties holding the commune, district and province names (GADM naming)
+DEFAULT_NAME_FIELDS = ('NAME_3', 'NAME_2', 'NAME_1')
+
+# Properties holding alternative names separated by '|', if present
+DEFAULT_VARNAME_FIELDS = ('VARNAME_3', 'VARNAME_2', 'VARNAME_1')
+
+def _ring_moments(ring):
+    """Signed area and first moments (area * centroid) of a ring of [x, y] points (shoelace formula)."""
+    area = cx = cy = 0.0
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+        cross = x0 * y1 - x1 * y0
+        area += cross
+        cx += (x0 + x1) * cross
+        cy += (y0 + y1) * cross
+    return area / 2, cx / 6, cy / 6
+
+def _polygons(geometry):
+    """The polygons (lists of rings, outer ring first) of a Polygon or MultiPolygon geometry."""
+    if not geometry:
+        return []
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    return []
+
+def _polygon_moments(polygon):
+    """Area and first moments of a polygon, with its holes subtracted."""
+    area = cx = cy = 0.0
+    for number, ring in enumerate(polygon):
+        ring_area, ring_cx, ring_cy = _ring_moments([point[:2] for point in ring])
+        sign = 1 if (ring_area >= 0) == (number == 0) else -1
+        area += sign * ring_area
+        cx += sign * ring_cx
+        cy += sign * ring_cy
+    if area < 0:
+        area, cx, cy = -area, -cx, -cy
+    return area, cx, cy
+
+def _crossings(polygon, y):
+    """Sorted x coordinates where the horizontal line at y crosses the rings of a polygon."""
+    xs = []
+    for ring in polygon:
+        for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+            if (y0 > y) != (y1 > y):
+                xs.append(x0 + (y - y0) * (x1 - x0) / (y1 - y0))
+    return sorted(xs)
+
+def _contains(polygon, x, y):
+    """Whether the point (x, y) lies inside the polygon (even-odd rule)."""
+    return sum(crossing < x for crossing in _crossings(polygon, y)) % 2 == 1
+
+def representative_point(polygons):
+    """Return (longitude, latitude, area) of a point inside a group of polygons, or None if they are empty."""
+    polygons = [[[point[:2] for point in ring] for ring in polygon] for polygon in polygons if polygon]
+    moments = [_polygon_moments(polygon) for polygon in polygons]
+    area = sum(moment[0] for moment in moments)
+    if not polygons or area <= 0:
+        return None
+    x = sum(moment[1] for moment in moments) / area
+    y = sum(moment[2] for moment in moments) / area
+    if any(_contains(polygon, x, y) for polygon in polygons):
+        return x, y, area
+
+    # Concave or split shape: use the widest segment of the largest polygon at the centroid's
+    # latitude, or at the middle of its bounding box if that line misses it
+    largest = polygons[max(range(len(polygons)), key=lambda number: moments[number][0])]
+    for line in (y, sum(bound(point[1] for point in largest[0]) for bound in (min, max)) / 2):
+        xs = _crossings(largest, line)
+        segments = list(zip(xs[0::2], xs[1::2]))
+        if segments:
+            start, end = max(segments, key=lambda segment: segment[1] - segment[0])
+            return (start + end) / 2, line, area
+    return x, y, area
+
+class Gazetteer:
+    """In-memory index of canonical commune, district and province keys -> (latitude, longitude, level)."""
+
+    def __init__(self, features, name_fields=DEFAULT_NAME_FIELDS, varname_fields=DEFAULT_VARNAME_FIELDS):
+        self._index = {}
+        self.ambiguous = 0
+        groups = {}
+        for feature in features:
+            properties = feature.get('properties') or {}
+            polygons = _polygons(feature.get('geometry'))
+            for names in self._name_variants(properties, name_fields, varname_fields):
+                xa, huyen, tinh = names
+                for parts in (address_parts(xa=xa, huyen=huyen, tinh=tinh),
+                              address_parts(huyen=huyen, tinh=tinh),
+                              address_parts(tinh=tinh)):
+                    if parts:
+                        level, members = groups.setdefault(self._key(canonical_key(parts)), (parts[0][0], {}))
+                        members[id(feature)] = polygons
+
+        for key, (level, members) in groups.items():
+            if level == 'xa':
+                # The same commune name twice in one district: keep the largest polygon
+                if len(members) > 1:
+                    self.ambiguous += 1
+                points = [representative_point(polygons) for polygons in members.values()]
+                point = max((point for point in points if point), key=lambda point: point[2], default=None)
+            else:
+                point = representative_point([polygon for polygons in members.values() for polygon in polygons])
+            if point:
+                self._index[key] = (point[1], point[0], level)
+
+    @staticmethod
+    def _key(key):
+        # Boundary files sometimes drop the spaces inside names ("AnGiang", "ChợMới")
+        return key.replace(' ', '')
+
+    @staticmethod
+    def _name_variants(properties, name_fields, varname_fields):
+        """Every (xa, huyen, tinh) spelling of a feature: its names, then each alternative name."""
+        names = [properties.get(field) for field in name_fields]
+        variants = [names]
+        for number, field in enumerate(varname_fields):
+            for alternative in str(properties.get(field) or '').split('|'):
+                if alternative.strip():
+                    variant = list(names)
+                    variant[number] = alternative
+                    variants.append(variant)
+        return variants
+
+    @classmethod
+    def from_geojson(cls, geojson_file, **kwargs):
+        with open(geojson_file, 'r', encoding='utf-8') as f:
+            geojson_data = json.load(f)
+        return cls(geojson_data['features'], **kwargs)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return self._key(key) in self._index
+
+    def lookup(self, key):
+        """Return the (latitude, longitude, level) of a canonical address key, or None."""
+        return self._index.get(self._key(key))
+
+def load_gazetteer(geojson_file=DEFAULT_GAZETTEER_FILE):
+    """Build the gazetteer from geojson_file, or return None (geocode online only) if it is missing."""
+    if not geojson_file or not os.path.exists(geojson_file):
+        print(f"Gazetteer {geojson_file} not found, geocoding online only.")
+        return None
+    try:
+        return Gazetteer.from_geojson(geojson_file)
+    except (ValueError, KeyError) as e:
+        print(f"An error occurred while loading the gazetteer {geojson_file}: {e}")
+        return None
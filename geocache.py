@@ -0,0 +1,184 @@
+# Persistent geocode cache shared by edgeocoder.py, xls2csv.py and xls2geojson.py
+# Coordinates are stored in a SQLite table indexed by address, so a lookup or an
+# insert costs one indexed statement instead of rewriting a whole CSV file.
+# A bounded LRU keeps the hot addresses in memory. The database runs in WAL mode
+# with a busy timeout so several scripts can share it at the same time, and a lock
+# makes one GeoCache object safe to use from several threads.
+# Addresses that failed to geocode are kept in a second table with the reason and
+# an expiry time, so reruns skip them until the TTL expires (or retry_failures is set).
+
+import csv
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Default cache location, can be overridden with the ED_GEOCACHE environment variable
+DEFAULT_CACHE_FILE = os.environ.get('ED_GEOCACHE', 'geocache.sqlite')
+
+# Number of addresses kept in memory
+DEFAULT_LRU_SIZE = 10000
+
+# Seconds before an address that was not found is tried again (ED_GEOCACHE_FAILURE_TTL, default 30 days)
+DEFAULT_FAILURE_TTL = float(os.environ.get('ED_GEOCACHE_FAILURE_TTL', 30 * 24 * 3600))
+
+# Seconds before an address that failed with a service error (timeout, HTTP error) is tried again
+DEFAULT_ERROR_TTL = 3600
+
+# Set ED_GEOCACHE_RETRY_FAILED=1 to ignore the recorded failures and try them all again
+DEFAULT_RETRY_FAILURES = os.environ.get('ED_GEOCACHE_RETRY_FAILED', '') not in ('', '0')
+
+# Failure reason of an address the geocoder answered without a result
+NOT_FOUND = 'not found'
+
+class GeoCache:
+    """Address -> (latitude, longitude, level) cache backed by SQLite with an in-memory LRU.
+
+    level is the administrative level that resolved the address (see address.py), or None.
+    Failed addresses are remembered for failure_ttl seconds (error_ttl for service errors).
+    """
+
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE, lru_size=DEFAULT_LRU_SIZE, failure_ttl=DEFAULT_FAILURE_TTL,
+                 error_ttl=DEFAULT_ERROR_TTL, retry_failures=DEFAULT_RETRY_FAILURES):
+        self.cache_file = cache_file
+        self.lru_size = lru_size
+        self.failure_ttl = failure_ttl
+        self.error_ttl = error_ttl
+        self.retry_failures = retry_failures
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_file, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS geocache (
+                                  address TEXT PRIMARY KEY,
+                                  latitude REAL NOT NULL,
+                                  longitude REAL NOT NULL,
+                                  updated REAL NOT NULL,
+                                  level TEXT)""")
+        # Caches created before the level column existed
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(geocache)")]
+        if 'level' not in columns:
+            self._conn.execute("ALTER TABLE geocache ADD COLUMN level TEXT")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS geocache_failures (
+                                  address TEXT PRIMARY KEY,
+                                  query TEXT,
+                                  reason TEXT NOT NULL,
+                                  attempts INTEGER NOT NULL,
+                                  updated REAL NOT NULL,
+                                  expires REAL NOT NULL)""")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, address):
+        return self.lookup(address) is not None
+
+    def _remember(self, address, entry):
+        self._lru[address] = entry
+        self._lru.move_to_end(address)
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def lookup(self, address):
+        """Return the cached (latitude, longitude, level) of address, or None."""
+        with self._lock:
+            if address in self._lru:
+                self._lru.move_to_end(address)
+                return self._lru[address]
+
+            row = self._conn.execute("SELECT latitude, longitude, level FROM geocache WHERE address = ?", (address,)).fetchone()
+            if row is None:
+                return None
+            entry = tuple(row)
+            self._remember(address, entry)
+            return entry
+
+    def get(self, address):
+        """Return the cached (latitude, longitude) of address, or None."""
+        entry = self.lookup(address)
+        return entry[:2] if entry else None
+
+    def put(self, address, latitude, longitude, level=None):
+        """Store the coordinates of address, replacing any previous value."""
+        entry = (float(latitude), float(longitude), level)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO geocache (address, latitude, longitude, level, updated) VALUES (?, ?, ?, ?, ?)",
+                               (address,) + entry + (time.time(),))
+            self._conn.execute("DELETE FROM geocache_failures WHERE address = ?", (address,))
+            self._remember(address, entry)
+
+    def failure(self, address):
+        """Return the reason address failed if that failure has not expired yet, else None.
+
+        Always None when retry_failures is set.
+        """
+        if self.retry_failures:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT reason FROM geocache_failures WHERE address = ? AND expires > ?",
+                                     (address, time.time())).fetchone()
+        return row[0] if row else None
+
+    def put_failure(self, address, reason=NOT_FOUND, query=None, ttl=None):
+        """Record that address failed to geocode; it is skipped for ttl seconds (failure_ttl by default)."""
+        now = time.time()
+        ttl = self.failure_ttl if ttl is None else ttl
+        with self._lock:
+            self._conn.execute("""INSERT INTO geocache_failures (address, query, reason, attempts, updated, expires)
+                                  VALUES (?, ?, ?, 1, ?, ?)
+                                  ON CONFLICT (address) DO UPDATE SET query = excluded.query, reason = excluded.reason,
+                                      attempts = attempts + 1, updated = excluded.updated, expires = excluded.expires""",
+                               (address, query, reason, now, now + ttl))
+
+    def failures(self):
+        """Return every recorded failure as (address, query, reason, attempts, updated, expires) rows, oldest first."""
+        with self._lock:
+            return self._conn.execute("SELECT address, query, reason, attempts, updated, expires FROM geocache_failures "
+                                      "ORDER BY updated").fetchall()
+
+    def export_failures(self, csv_file):
+        """Write the recorded failures to csv_file so they can be fixed by hand. Returns the number of rows."""
+        rows = self.failures()
+        with open(csv_file, mode='w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['address', 'query', 'reason', 'attempts', 'updated', 'expires'])
+            for address, query, reason, attempts, updated, expires in rows:
+                writer.writerow([address, query, reason, attempts,
+                                 time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(updated)),
+                                 time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(expires))])
+        return len(rows)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM geocache").fetchone()[0]
+
+    def import_csv(self, csv_file, key_func=None):
+        """Import an old geocache.csv (address, latitude, longitude rows) without overwriting newer entries.
+
+        key_func, if given, turns each address into the key it is stored under.
+        """
+        rows = []
+        with open(csv_file, mode='r', newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if len(row) != 3:
+                    continue
+                address, latitude, longitude = row
+                try:
+                    rows.append((key_func(address) if key_func else address, float(latitude), float(longitude), time.time()))
+                except ValueError as e:
+                    print(f"Error parsing coordinates for address {address}: {e}")
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR IGNORE INTO geocache (address, latitude, longitude, updated) VALUES (?, ?, ?, ?)", rows)
+            self._conn.execute("COMMIT")
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,98 @@
+# Load test of the geocoding path against the local Nominatim stand-in (nominatim_stub.py)
+# Synthetic rows are drawn from the fixture addresses (with repeats, as in a line listing)
+# plus a fraction of unknown addresses, then geocoded exactly like xls2csv.py does:
+# geocode_unique with a fresh in-memory cache and a GeocodingEngine. It reports rows/s,
+# requests/s, the latency percentiles of the requests, the errors seen by the engine,
+# the 429 responses sent by the server and the rate the engine adapted to.
+
+import argparse
+import csv
+import random
+import threading
+import time
+import pandas as pd
+from address import geocode_unique, split_address
+from geocache import GeoCache
+from geocoder import GeocodingEngine
+from nominatim_stub import StubConfig, load_places, start_server
+
+def fixture_addresses(csv_file):
+    """The address column of a fixture CSV."""
+    with open(csv_file, mode='r', newline='', encoding='utf-8') as f:
+        return [row[0] for row in csv.reader(f) if len(row) >= 3 and row[0] != 'address']
+
+def generate_rows(addresses, count, miss_rate, seed=0):
+    """count addresses drawn from the fixture, a miss_rate fraction of them replaced by unknown ones."""
+    rnd = random.Random(seed)
+    rows = []
+    for number in range(count):
+        if not addresses or rnd.random() < miss_rate:
+            rows.append(f"Ấp {number}, Xã Không Có {rnd.randint(1, count)}, Huyện Không Có, Tỉnh Không Có")
+        else:
+            rows.append(rnd.choice(addresses))
+    return rows
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def main(args):
+    server = None
+    url = args.url
+    if not url:
+        config = StubConfig(args.latency, args.jitter, args.error_rate, args.throttle_rate, args.server_rate_limit,
+                            error_status=args.error_status)
+        server = start_server(load_places(args.fixture), config=config)
+        url = server.url
+
+    engine = GeocodingEngine(args.rate_limit, args.workers, user_agent="edgcoder_loadtest", timeout=args.timeout, base_url=url)
+    latencies = []
+    lock = threading.Lock()
+
+    # Time every request that reaches the engine
+    def timed_geocode(query):
+        start = time.perf_counter()
+        try:
+            return engine.geocode(query)
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    df = pd.DataFrame({'address': generate_rows(fixture_addresses(args.fixture), args.rows, args.miss_rate, args.seed)})
+    start = time.perf_counter()
+    with GeoCache(':memory:') as cache:
+        geocoded = geocode_unique(df, ['address'], split_address, timed_geocode, cache, mapper=engine.map)
+    elapsed = time.perf_counter() - start
+    engine.close()
+
+    resolved = int(geocoded['latitude'].notna().sum())
+    print(f"Target          : {url} (rate limit {args.rate_limit}/s, {args.workers} workers)")
+    print(f"Rows            : {len(df)} ({df['address'].nunique()} distinct), {resolved} resolved")
+    print(f"Elapsed         : {elapsed:.2f} s")
+    print(f"Throughput      : {len(df) / elapsed:,.1f} rows/s, {engine.stats['requests'] / elapsed:,.2f} requests/s")
+    print(f"Latency         : p50 {percentile(latencies, 0.5) * 1000:.0f} ms, p95 {percentile(latencies, 0.95) * 1000:.0f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.0f} ms, max {max(latencies, default=0) * 1000:.0f} ms")
+    print(f"Engine          : {dict(engine.stats)}, final rate {engine.bucket.rate:.2f}/s, breaker {engine.breaker.state}")
+    if server:
+        print(f"Server          : {dict(server.stats)}")
+        server.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the geocoders against a local Nominatim stand-in.")
+    parser.add_argument('--fixture', default='addresses_geocoded.csv', help="CSV of address, latitude, longitude rows.")
+    parser.add_argument('--url', default=None, help="Base URL of a running server (default: start a stand-in in-process).")
+    parser.add_argument('--rows', type=int, default=1000, help="Number of synthetic rows.")
+    parser.add_argument('--miss-rate', type=float, default=0.1, help="Fraction of rows with an unknown address.")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for the synthetic rows.")
+    parser.add_argument('--rate-limit', type=float, default=50, help="Engine rate limit in requests per second.")
+    parser.add_argument('--workers', type=int, default=8, help="Concurrent requests of the engine.")
+    parser.add_argument('--timeout', type=float, default=10, help="Request timeout in seconds.")
+    parser.add_argument('--latency', type=float, default=0.05, help="Stand-in latency in seconds.")
+    parser.add_argument('--jitter', type=float, default=0.05, help="Stand-in extra random latency in seconds.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with an HTTP error.")
+    parser.add_argument('--error-status', type=int, default=503, choices=(500, 502, 503, 504), help="HTTP status of those errors (500/502 check that they are retried too).")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of requests answered with HTTP 429.")
+    parser.add_argument('--server-rate-limit', type=float, default=None, help="Stand-in rate limit (HTTP 429 above it).")
+    main(parser.parse_args())
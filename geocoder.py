@@ -0,0 +1,317 @@
+# Concurrent geocoding engine shared by edgeocoder.py, xls2csv.py and xls2geojson.py
+# Requests run in a thread pool so that their latency overlaps, while a token bucket
+# shared by all threads keeps the request rate at exactly rate_limit per second.
+# One geolocator is reused for every request, a query already in flight is not sent
+# twice, and cancel() (called from the scripts' SIGINT handlers) stops the queue.
+# A request that fails (timeout, HTTP error) raises GeocodingError, unlike an address
+# that is simply not found, so callers do not remember transient errors for long.
+# Timeouts, HTTP 429 and 5xx responses are retried with exponential backoff and full
+# jitter; they also halve the request rate, which then climbs back towards rate_limit
+# while requests succeed quickly (AIMD). After several timeouts or 5xx responses in a
+# row a circuit breaker pauses the whole queue, then lets a single probe request through;
+# 429 responses only slow the rate down, since the provider is up and answering.
+# Requests go to NOMINATIM_URL, which can point at a local server (e.g. nominatim_stub.py).
+
+import os
+import random
+import threading
+import time
+import urllib.parse
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from geopy.adapters import AdapterHTTPError, RequestsAdapter
+from geopy.geocoders import Nominatim
+from geopy.exc import GeocoderQuotaExceeded, GeocoderServiceError, GeocoderTimedOut, GeocoderUnavailable
+
+# Base URL of the Nominatim API, can be overridden with ED_NOMINATIM_URL (e.g. http://127.0.0.1:8088)
+NOMINATIM_URL = os.environ.get('ED_NOMINATIM_URL', 'https://nominatim.openstreetmap.org')
+
+# Errors worth retrying: the provider is slow, overloaded or throttling us (429 is a GeocoderQuotaExceeded)
+RETRYABLE_ERRORS = (GeocoderTimedOut, GeocoderUnavailable, GeocoderQuotaExceeded)
+
+# Retryable errors that mean the provider is unhealthy, rather than throttling us
+# (geopy raises a plain GeocoderServiceError for the 5xx responses other than 503, see is_server_error)
+UNHEALTHY_ERRORS = (GeocoderTimedOut, GeocoderUnavailable)
+
+# Retries of a request after a retryable error, and the backoff bounds in seconds
+DEFAULT_RETRIES = 3
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+
+# Consecutive retryable errors that open the circuit breaker, and its first pause in seconds
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30
+BREAKER_MAX_COOLDOWN = 600
+
+def is_server_error(error):
+    """Whether error is a plain GeocoderServiceError raised for an HTTP 5xx answer (500, 502, ...)."""
+    cause = error.__cause__
+    return type(error) is GeocoderServiceError and isinstance(cause, AdapterHTTPError) and cause.status_code >= 500
+
+def is_retryable(error):
+    """Whether a GeocoderServiceError is worth retrying (timeouts, 429 and 5xx answers)."""
+    return isinstance(error, RETRYABLE_ERRORS) or is_server_error(error)
+
+def is_unhealthy(error):
+    """Whether a retryable error counts against the circuit breaker (timeouts and 5xx, not 429)."""
+    return isinstance(error, UNHEALTHY_ERRORS) or is_server_error(error)
+
+class GeocodingCancelled(Exception):
+    """Raised by GeocodingEngine.geocode once the engine has been cancelled."""
+
+class GeocodingError(Exception):
+    """Raised by GeocodingEngine.geocode when the request itself failed; the message is the reason."""
+
+def nominatim(base_url, user_agent):
+    """Create a geopy Nominatim geolocator sending its requests to base_url.
+
+    The requests adapter is built without its own retries: urllib3 would otherwise sleep
+    through 429 responses silently, hiding them from the engine's rate control.
+    """
+    url = urllib.parse.urlsplit(base_url)
+    adapter_factory = None
+    if RequestsAdapter.is_available:
+        adapter_factory = lambda proxies, ssl_context: RequestsAdapter(proxies=proxies, ssl_context=ssl_context, max_retries=0)
+    return Nominatim(user_agent=user_agent, scheme=url.scheme or 'https', domain=url.netloc + url.path.rstrip('/'),
+                     adapter_factory=adapter_factory)
+
+class TokenBucket:
+    """Thread-safe token bucket allowing rate acquisitions per second, with bursts of at most capacity."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cancelled=None):
+        """Block until a token is available. Returns False if the cancelled event is set while waiting."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+
+            if cancelled is None:
+                time.sleep(wait)
+            elif cancelled.wait(wait):
+                return False
+
+    def set_rate(self, rate):
+        """Change the rate, keeping the tokens earned so far at the old rate."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.rate = rate
+
+class AdaptiveRate:
+    """Adjust a token bucket's rate between min_rate and max_rate from the outcome of each request.
+
+    A request answered faster than slow_latency seconds raises the rate by max_rate / 20,
+    a slower one lowers it by 10%, and a retryable error halves it.
+    """
+
+    def __init__(self, bucket, max_rate, min_rate=None, slow_latency=5):
+        self.bucket = bucket
+        self.max_rate = max_rate
+        self.min_rate = min_rate or max_rate / 20
+        self.slow_latency = slow_latency
+
+    def _set(self, rate):
+        self.bucket.set_rate(min(self.max_rate, max(self.min_rate, rate)))
+
+    def success(self, latency):
+        if latency > self.slow_latency:
+            self._set(self.bucket.rate * 0.9)
+        else:
+            self._set(self.bucket.rate + self.max_rate / 20)
+
+    def error(self):
+        self._set(self.bucket.rate / 2)
+
+class CircuitBreaker:
+    """Pause every request after threshold consecutive errors.
+
+    The circuit stays open for cooldown seconds, then lets one probe request through
+    (half-open): a success closes it, an error opens it again for twice as long, up to
+    max_cooldown.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN, max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = 'closed'
+        self._errors = 0
+        self._pause = cooldown
+        self._opened_until = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def wait(self, cancelled=None):
+        """Block while the circuit is open. Returns False if the cancelled event is set while waiting."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self.state == 'open' and now >= self._opened_until:
+                    self.state = 'half-open'
+                    self._probing = False
+                if self.state == 'closed':
+                    return True
+                if self.state == 'half-open' and not self._probing:
+                    self._probing = True
+                    return True
+                wait = max(self._opened_until - now, 0.1)
+
+            if cancelled is None:
+                time.sleep(wait)
+            elif cancelled.wait(wait):
+                return False
+
+    def success(self):
+        with self._lock:
+            self._errors = 0
+            if self.state != 'closed':
+                print("\nGeocoding provider is healthy again, resuming.")
+            self.state = 'closed'
+            self._pause = self.cooldown
+
+    def error(self):
+        with self._lock:
+            self._errors += 1
+            if self.state == 'half-open':
+                self._pause = min(self.max_cooldown, self._pause * 2)
+            elif self.state == 'open' or self._errors < self.threshold:
+                return
+            self.state = 'open'
+            self._opened_until = time.monotonic() + self._pause
+            print(f"\nGeocoding provider is unhealthy ({self._errors} errors in a row), pausing for {self._pause:.0f}s.")
+
+class GeocodingEngine:
+    """Rate-limited, de-duplicating geocoder that runs requests concurrently.
+
+    rate_limit is the maximum number of requests per second; the actual rate adapts
+    below it when the provider errors or slows down. stats counts the requests,
+    retries and errors.
+    """
+
+    def __init__(self, rate_limit=1, workers=4, user_agent="edgcoder", timeout=10, geolocator=None,
+                 retries=DEFAULT_RETRIES, breaker=None, base_url=None):
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.geolocator = geolocator or nominatim(base_url or NOMINATIM_URL, user_agent)
+        self.bucket = TokenBucket(rate_limit)
+        self.rate = AdaptiveRate(self.bucket, rate_limit, slow_latency=timeout / 2)
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = Counter()
+        self._cancelled = threading.Event()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def cancel(self):
+        """Stop sending requests: waiting and future calls to geocode raise GeocodingCancelled."""
+        self._cancelled.set()
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def geocode(self, query):
+        """Geocode one query string and return the geopy location, or None if not found.
+
+        Raises GeocodingError if the request failed and GeocodingCancelled once cancelled.
+        """
+        with self._lock:
+            future = self._in_flight.get(query)
+            owner = future is None
+            if owner:
+                future = self._in_flight[query] = Future()
+
+        # Another thread is already geocoding the same query: share its result
+        if not owner:
+            return future.result()
+
+        try:
+            location = self._request(query)
+            future.set_result(location)
+            return location
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[query]
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to wait before retry number attempt + 1: full jitter, at least the server's Retry-After."""
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+        return max(delay, retry_after or 0)
+
+    def _request(self, query):
+        """Send one query, retrying retryable errors; raises GeocodingError once they are exhausted."""
+        for attempt in range(self.retries + 1):
+            if not self.breaker.wait(self._cancelled) or not self.bucket.acquire(self._cancelled):
+                raise GeocodingCancelled(query)
+
+            self._count('requests')
+            start = time.monotonic()
+            try:
+                location = self.geolocator.geocode(query, timeout=self.timeout)
+            except GeocoderServiceError as e:
+                self._count(type(e).__name__)
+                if not is_retryable(e):
+                    # The provider answered, it just refused this query (or our credentials): not worth retrying
+                    self.breaker.success()
+                    raise GeocodingError(f"{type(e).__name__}: {e}") from e
+                if is_unhealthy(e):
+                    self.breaker.error()
+                else:
+                    self.breaker.success()
+                self.rate.error()
+                error = e
+                if attempt < self.retries:
+                    self._count('retries')
+                    if self._cancelled.wait(self.backoff(attempt, getattr(e, 'retry_after', None))):
+                        raise GeocodingCancelled(query)
+                continue
+
+            self.breaker.success()
+            self.rate.success(time.monotonic() - start)
+            return location
+
+        raise GeocodingError(f"{type(error).__name__}: {error} (after {self.retries + 1} attempts)") from error
+
+    def map(self, func, iterable):
+        """Like map(func, iterable), but runs func in the engine's threads and yields results in order.
+
+        Only a bounded number of items are in flight, and no new ones are started once cancelled.
+        """
+        pending = deque()
+        for item in iterable:
+            if self.cancelled():
+                break
+            pending.append(self._executor.submit(func, item))
+            if len(pending) >= 4 * self.workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,186 @@
+# Streaming GeoJSON I/O for large case sets (24 years of line listings do not fit in one json.load)
+# GeoJSONWriter emits features one at a time, with compact separators, either inside a single
+# FeatureCollection or as newline-delimited GeoJSON (GeoJSONSeq, one feature per line). The
+# format follows the file extension (.geojsonl, .geojsonseq, .ndjson and .jsonl are sequences)
+# and a .gz suffix compresses the output on the fly. iter_features reads both formats back
+# feature by feature: a FeatureCollection is decoded incrementally from a fixed-size buffer,
+# so memory stays flat whatever the size of the archive.
+
+import argparse
+import gzip
+import json
+
+# Extensions of newline-delimited GeoJSON files (after removing .gz)
+SEQUENCE_EXTENSIONS = ('.geojsonl', '.geojsonseq', '.ndjson', '.jsonl')
+
+# Characters read at a time by the FeatureCollection reader
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+# Record separator that may prefix each feature of a GeoJSONSeq file (RFC 8142)
+RECORD_SEPARATOR = '\x1e'
+
+def is_sequence(file_name):
+    """Whether a file name denotes newline-delimited GeoJSON."""
+    if file_name.endswith('.gz'):
+        file_name = file_name[:-3]
+    return file_name.lower().endswith(SEQUENCE_EXTENSIONS)
+
+def _open(file_name, mode, compress=None):
+    """Open a text file, through gzip if compress is set (or, when None, if the name ends with .gz)."""
+    if compress is None:
+        if 'r' in mode:
+            with open(file_name, 'rb') as f:
+                compress = f.read(2) == b'\x1f\x8b'
+        else:
+            compress = file_name.endswith('.gz')
+    if compress:
+        return gzip.open(file_name, mode + 't', encoding='utf-8', newline='')
+    return open(file_name, mode, encoding='utf-8', newline='')
+
+class GeoJSONWriter:
+    """Write features to a FeatureCollection or a GeoJSONSeq file as they come.
+
+    sequence and compress default to what the file name says (see is_sequence and the
+    .gz suffix). count is the number of features written.
+    """
+
+    def __init__(self, file_name, sequence=None, compress=None):
+        self.file_name = file_name
+        self.sequence = is_sequence(file_name) if sequence is None else sequence
+        self.count = 0
+        self._file = _open(file_name, 'w', compress)
+        if not self.sequence:
+            self._file.write('{"type":"FeatureCollection","features":[\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, feature):
+        text = json.dumps(feature, ensure_ascii=False, separators=(',', ':'))
+        if not self.sequence and self.count:
+            text = ',\n' + text
+        self._file.write(text if not self.sequence else text + '\n')
+        self.count += 1
+
+    def close(self):
+        """Close the collection (if any) and the file."""
+        if not self._file.closed:
+            if not self.sequence:
+                self._file.write('\n]}\n')
+            self._file.close()
+
+def write_features(features, file_name, sequence=None, compress=None):
+    """Write an iterable of features with a GeoJSONWriter. Returns the number written."""
+    with GeoJSONWriter(file_name, sequence, compress) as writer:
+        for feature in features:
+            writer.write(feature)
+    return writer.count
+
+class _Scanner:
+    """Incremental JSON tokenizer over a text file, keeping only the undecoded part in memory."""
+
+    def __init__(self, f, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Read the next chunk, dropping what has been decoded already. False at end of file."""
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """The next non-blank character, or None at end of file."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return None
+
+    def expect(self, chars):
+        char = self.peek()
+        if char is None or char not in chars:
+            raise ValueError(f"Expected {' or '.join(repr(c) for c in chars)} in GeoJSON, found {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next JSON value, reading more chunks until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+def _iter_collection(f, chunk_size):
+    scanner = _Scanner(f, chunk_size)
+    scanner.expect('{')
+    if scanner.peek() == '}':
+        return
+    while True:
+        key = scanner.value()
+        scanner.expect(':')
+        if key == 'features':
+            scanner.expect('[')
+            if scanner.peek() == ']':
+                scanner.pos += 1
+            else:
+                while True:
+                    yield scanner.value()
+                    if scanner.expect(',]') == ']':
+                        break
+        else:
+            # Other members (type, crs, bbox, ...) are small, skip them
+            scanner.value()
+        if scanner.expect(',}') == '}':
+            return
+
+def _iter_sequence(f):
+    for line in f:
+        line = line.strip().lstrip(RECORD_SEPARATOR)
+        if line:
+            yield json.loads(line)
+
+def iter_features(file_name, sequence=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the features of a FeatureCollection or GeoJSONSeq file (gzipped or not) one at a time.
+
+    sequence defaults to what the file name says (see is_sequence).
+    """
+    if sequence is None:
+        sequence = is_sequence(file_name)
+    with _open(file_name, 'r') as f:
+        if sequence:
+            yield from _iter_sequence(f)
+        else:
+            yield from _iter_collection(f, chunk_size)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert between GeoJSON FeatureCollection and GeoJSONSeq files, streaming.")
+    parser.add_argument('input', help="Input file (.geojson, .geojsonl, ..., optionally .gz).")
+    parser.add_argument('output', help="Output file; its extension selects the format and compression.")
+    args = parser.parse_args()
+
+    count = write_features(iter_features(args.input), args.output)
+    print(f"{count} features written to {args.output}")
@@ -0,0 +1,85 @@
+# Append-only journal of per-row results, used by edgeocoder.py and xls2csv.py to resume
+# Each result is one JSON line appended to the journal file; lines are flushed and fsynced
+# in batches, so a checkpoint costs the same for every row and a crash loses at most the
+# last batch. The first line records the hash of the input the journal belongs to, so a
+# journal left by another version of the input is discarded instead of replayed (a journal
+# without an input, such as the list of workbooks done by xls2csv.py, is always replayed).
+
+import json
+import os
+from vnconvert import file_hash
+
+# Results written between two fsyncs
+DEFAULT_BATCH_SIZE = 100
+
+class Journal:
+    """JSON lines journal of the results computed from one input file."""
+
+    def __init__(self, journal_file, input_file=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.journal_file = journal_file
+        self.batch_size = batch_size
+        self.input_hash = file_hash(input_file) if input_file else None
+        self.records = self._replay()
+        self._pending = 0
+        self._file = open(journal_file, mode='a', encoding='utf-8')
+        if self._file.tell() == 0:
+            self._write({'input': os.path.basename(input_file) if input_file else None, 'hash': self.input_hash})
+            self.sync()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _replay(self):
+        """Read back the records of a previous run, or start over if the journal belongs to another input."""
+        if not os.path.exists(self.journal_file):
+            return []
+        records = []
+        with open(self.journal_file, mode='rb') as f:
+            data = f.read()
+        end = 0
+        for number, line in enumerate(data.split(b'\n')[:-1]):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if number == 0 and record.get('hash') != self.input_hash:
+                print(f"Journal {self.journal_file} belongs to another version of the input, starting over.")
+                os.remove(self.journal_file)
+                return []
+            if number > 0:
+                records.append(record)
+            end += len(line) + 1
+
+        # Drop a line cut short by a crash, so new records start on a line of their own
+        if end < len(data):
+            print(f"Ignoring the truncated end of journal {self.journal_file}.")
+            os.truncate(self.journal_file, end)
+        return records
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def append(self, record):
+        """Add a record; it is durable after the next sync, at most batch_size records later."""
+        self._write(record)
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def remove(self):
+        """Close and delete the journal once its results have been materialized."""
+        self.close()
+        os.remove(self.journal_file)
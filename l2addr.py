@@ -2,30 +2,46 @@
 # Maso: the unique case ID
 # L2Addr: the level 2 address of the case
 # The output file will be used to geocode dengue cases
+# The line listing is read in chunks of CHUNK_SIZE rows, only the columns needed, and the
+# address is built column-wise, so files of millions of rows take seconds and little memory.
 
 import pandas as pd
 import sys
 import os
+from provinces import province_names
 
-# Function to map MaTinh to Tinh
-def map_ma_tinh(ma_tinh):
-    mapping = {
-        "AGG": "An Giang",
-        "HGG": "Hậu Giang",
-        "BLU": "Bạc Liêu",
-        "BTE": "Bến Tre",
-        "CTO": "Cần Thơ",
-        "CMU": "Cà Mau",
-        "DTP": "Đồng Tháp",
-        "HGG": "Hậu Giang",
-        "KGG": "Kiên Giang",
-        "LAN": "Long An",
-        "STG": "Sóc Trăng",
-        "TGG": "Tiền Giang",
-        "THV": "Trà Vinh",
-        "VLG": "Vĩnh Long"        
-    }
-    return mapping.get(ma_tinh, "")
+# Rows read at a time
+CHUNK_SIZE = 500000
+
+# Columns read from the line listing
+INPUT_COLUMNS = ['MaSo', 'VaoVien', 'RaVien', 'DiaChi', 'Ap', 'Xa', 'Huyen', 'MaTinh']
+
+# Columns of the output file
+OUTPUT_COLUMNS = ['MaSo', 'L2Addr', 'VaoVien', 'RaVien', 'DiaChi', 'Ap', 'Xa', 'Huyen', 'Tinh']
+
+# Function to build the key fields of a chunk of the line listing
+def build_l2addr(df):
+    # Keep the rows with a valid MaTinh
+    df = df[df['MaTinh'].notnull()]
+
+    # Create the address field, missing communes and districts are written 'nan' as before
+    tinh = province_names(df['MaTinh'])
+    df = df.assign(Tinh=tinh, L2Addr=df['Xa'].fillna('nan') + ', ' + df['Huyen'].fillna('nan') + ', ' + tinh)
+
+    # Create a new DataFrame with key fields
+    return df[OUTPUT_COLUMNS]
+
+# Function to convert a line listing, chunk by chunk; returns the number of rows written
+def convert_file(input_csv_file, output_csv_file, chunk_size=CHUNK_SIZE):
+    count = 0
+    # Every column is read as text, so the values are written back as they are
+    reader = pd.read_csv(input_csv_file, usecols=INPUT_COLUMNS, dtype=str, chunksize=chunk_size)
+    with open(output_csv_file, 'w', newline='', encoding='utf-8') as f:
+        for number, chunk in enumerate(reader):
+            new_df = build_l2addr(chunk)
+            new_df.to_csv(f, header=number == 0, index=False)
+            count += len(new_df)
+    return count
 
 def main():
     # Check if the input filename is provided
@@ -41,28 +57,14 @@ def main():
         print(f"Error: The file '{input_csv_file}' does not exist.")
         sys.exit(1)
 
-    # Read the CSV file
-    df = pd.read_csv(input_csv_file)
-
-    # Create a new DataFrame for rows with valid MaTinh
-    df = df[df['MaTinh'].notnull()]
-
-    # Create the address field
-    df['L2Addr'] = df.apply(lambda row: f"{row['Xa']}, {row['Huyen']}, {map_ma_tinh(row['MaTinh'])}", axis=1)
-    df['Tinh'] = df.apply(lambda row: f"{map_ma_tinh(row['MaTinh'])}", axis=1)
-
-    # Create a new DataFrame with key fields
-    new_df = df[['MaSo', 'L2Addr', 'VaoVien', 'RaVien', 'DiaChi', 'Ap', 'Xa', 'Huyen', 'Tinh']]
-    
-
     # Create the output filename based on the input filename
     input_filename, input_extension = os.path.splitext(input_csv_file)
     output_csv_file = f"{input_filename}_L2Addr{input_extension}"
 
-    # Write the new DataFrame to a new CSV file
-    new_df.to_csv(output_csv_file, index=False)
+    # Write the new CSV file, chunk by chunk
+    count = convert_file(input_csv_file, output_csv_file)
 
-    print(f"Success: new CSV file '{output_csv_file}' has been created.")
+    print(f"Success: new CSV file '{output_csv_file}' has been created ({count} rows).")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,73 @@
+# Column-wise preparation of case line-listing DataFrames (the ED_*.xlsx workbooks)
+# Date cells come in three shapes: datetimes parsed by read_excel, Excel serial day
+# numbers (44562 or "44562.0") and DD/MM/YYYY strings. normalize_dates converts whole
+# columns to ISO 8601 strings at once, before any feature is built.
+# Excel's 1900 date system counts 1900 as a leap year: serial 1 is 1900-01-01, the
+# non-existent 1900-02-29 is serial 60, and from serial 61 (1900-03-01) on a date is
+# 1899-12-30 plus the serial. Serial 60 and out-of-range serials are left unchanged.
+
+import numpy as np
+import pandas as pd
+
+# Date columns of a line listing
+DATE_COLUMNS = ('VaoVien', 'RaVien', 'NgayTV', 'NgayKB', 'NgayBC', 'NgayNL', 'NgayHC')
+
+# Day 0 of the Excel serials from 1900-03-01 (serial 61) on
+EXCEL_EPOCH = pd.Timestamp('1899-12-30')
+
+# Largest serial Excel accepts (9999-12-31)
+EXCEL_MAX_SERIAL = 2958465
+
+# Output format, the same as datetime.isoformat() for whole seconds
+ISO_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+def excel_serial_to_datetime(serials):
+    """Convert Excel serial day numbers (1900 date system) to datetimes, ignoring the time of day.
+
+    NaT where the value is not a number, is serial 60 (1900-02-29) or is out of range.
+    """
+    days = np.floor(pd.to_numeric(serials, errors='coerce'))
+    valid = (days >= 1) & (days <= EXCEL_MAX_SERIAL) & (days != 60)
+    # Before the fake leap day, serials are one day ahead of the epoch
+    days = days.where(days > 60, days + 1).where(valid)
+    return EXCEL_EPOCH + pd.to_timedelta(days, unit='D')
+
+def _normalize_values(series):
+    text = series.astype(object).where(series.notna(), '').astype(str)
+
+    # Datetimes parsed by read_excel (a datetime64 column, or datetime objects in an object column)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        parsed = series.dt.tz_localize(None) if series.dt.tz is not None else series
+    else:
+        is_datetime = series.map(lambda value: hasattr(value, 'year') and hasattr(value, 'month'))
+        parsed = pd.to_datetime(series.where(is_datetime), errors='coerce')
+
+        # Excel serial numbers, as numbers or as digit strings
+        is_serial = text.str.fullmatch(r'\s*\d+(?:\.\d+)?\s*') & ~is_datetime
+        parsed = parsed.fillna(excel_serial_to_datetime(text.where(is_serial)))
+
+        # DD/MM/YYYY strings (a time after the date is ignored)
+        parts = text.str.extract(r'^\s*(\d{1,2})/(\d{1,2})/(\d{4})')
+        day_first = pd.to_datetime(parts[0] + '/' + parts[1] + '/' + parts[2], format='%d/%m/%Y', errors='coerce')
+        parsed = parsed.fillna(day_first)
+
+    iso = parsed.dt.strftime(ISO_FORMAT)
+    return iso.where(parsed.notna(), text).astype(object)
+
+def normalize_date_column(series):
+    """Return series with every recognised date as an ISO 8601 string.
+
+    Other values are kept as strings, and missing values become ''. Line listings
+    repeat the same dates a lot, so only the distinct values are converted.
+    """
+    codes, uniques = pd.factorize(series)
+    normalized = np.append(_normalize_values(pd.Series(uniques)).to_numpy(), '')
+    return pd.Series(normalized[codes], index=series.index, dtype=object)
+
+def normalize_dates(df, columns=DATE_COLUMNS):
+    """Return a copy of df with its date columns (the ones present) normalized by normalize_date_column."""
+    df = df.copy()
+    for column in columns:
+        if column in df.columns:
+            df[column] = normalize_date_column(df[column])
+    return df
@@ -0,0 +1,125 @@
+# MongoDB access for the case features written by xls2geojson.py
+# The connection settings come from a JSON config file (ED_MONGO_CONFIG, mongo_config.json by
+# default) and/or ED_MONGO_* environment variables, never from the code. One pooled client is
+# kept for the whole run, and MongoWriter buffers the features and writes them with unordered
+# bulk upserts keyed by the unique properties.patient.id index: a case already in the
+# collection is left untouched, as the old find_one/insert_one pair did, but a batch of
+# features costs one round trip instead of two per case.
+
+import json
+import os
+import urllib.parse
+from collections import Counter
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+# Default config file, can be overridden with the ED_MONGO_CONFIG environment variable
+DEFAULT_CONFIG_FILE = os.environ.get('ED_MONGO_CONFIG', 'mongo_config.json')
+
+# Settings used when neither the config file nor the environment sets them
+DEFAULT_CONFIG = {
+    'host': 'localhost:27017',
+    'username': None,
+    'password': None,
+    'auth_source': 'admin',
+    'uri': None,              # full connection URI, overrides host, username and password
+    'db': 'oct_e_dengue',
+    'collection': 'historical_cases_2022',
+    'max_pool_size': 10,
+}
+
+# Features buffered by MongoWriter before a bulk write
+DEFAULT_BATCH_SIZE = 500
+
+# Unique key of a case feature
+PATIENT_ID = 'properties.patient.id'
+
+def load_config(config_file=DEFAULT_CONFIG_FILE):
+    """Return the MongoDB settings: defaults, then the config file (if any), then ED_MONGO_<SETTING> variables."""
+    config = dict(DEFAULT_CONFIG)
+    if config_file and os.path.exists(config_file):
+        with open(config_file, 'r', encoding='utf-8') as f:
+            config.update(json.load(f))
+    for name in DEFAULT_CONFIG:
+        value = os.environ.get('ED_MONGO_' + name.upper())
+        if value is not None:
+            config[name] = int(value) if name == 'max_pool_size' else value
+    return config
+
+def mongo_uri(config):
+    """The connection URI of a config, with the credentials quoted."""
+    if config.get('uri'):
+        return config['uri']
+    credentials = ''
+    if config.get('username'):
+        credentials = urllib.parse.quote(config['username'], safe='')
+        if config.get('password'):
+            credentials += ':' + urllib.parse.quote(config['password'], safe='')
+        credentials += '@'
+    return f"mongodb://{credentials}{config['host']}/"
+
+def connect(config):
+    """Create the pooled client of a run."""
+    return MongoClient(mongo_uri(config), authSource=config['auth_source'], maxPoolSize=config['max_pool_size'])
+
+def get_collection(config, client=None):
+    """Return the case collection of a config, connecting if no client is given."""
+    client = client or connect(config)
+    return client[config['db']][config['collection']]
+
+class MongoWriter:
+    """Buffer case features and upsert them in unordered bulk writes.
+
+    stats counts the features inserted, skipped (already in the collection) and failed.
+    """
+
+    def __init__(self, collection, batch_size=DEFAULT_BATCH_SIZE, verbose=False):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self.stats = Counter()
+        self._buffer = []
+        collection.create_index([(PATIENT_ID, ASCENDING)], unique=True, name='patient_id_unique')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, feature):
+        """Queue a feature; the buffer is written once it holds batch_size features."""
+        self._buffer.append(feature)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered features. Returns the number of features that failed."""
+        if not self._buffer:
+            return 0
+        features, self._buffer = self._buffer, []
+        requests = [UpdateOne({PATIENT_ID: feature['properties']['patient']['id']}, {'$setOnInsert': feature}, upsert=True)
+                    for feature in features]
+        try:
+            result = self.collection.bulk_write(requests, ordered=False)
+            inserted, matched, failed = result.upserted_count, result.matched_count, 0
+        except BulkWriteError as e:
+            # Unordered: the other features were still written
+            details = e.details
+            inserted, matched, failed = details['nUpserted'], details['nMatched'], len(details['writeErrors'])
+            for error in details['writeErrors'][:5]:
+                print(f"Error saving to MongoDB: {error.get('errmsg')}")
+        except PyMongoError as e:
+            print(f"Error saving to MongoDB: {e}")
+            inserted, matched, failed = 0, 0, len(features)
+
+        self.stats.update(inserted=inserted, skipped=matched, failed=failed)
+        if self.verbose:
+            print(f"MongoDB batch of {len(features)}: {inserted} inserted, {matched} skipped, {failed} failed")
+        return failed
+
+    def close(self):
+        self.flush()
+
+    def summary(self):
+        return f"{self.stats['inserted']} inserted, {self.stats['skipped']} skipped, {self.stats['failed']} failed"
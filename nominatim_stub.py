@@ -0,0 +1,171 @@
+# Local stand-in for the Nominatim /search?format=json API, for load tests and regression runs
+# It answers from a fixture gazetteer instead of OpenStreetMap: a CSV of address, latitude,
+# longitude rows (the format of addresses_geocoded.csv and the old geocache.csv) and/or the
+# level-3 boundary GeoJSON (see gazetteer.py). Queries are matched on their canonical
+# address key (see address.py), so spelling, case and prefixes do not matter.
+# Latency, random 5xx errors (503, or 500/502 with --error-status), random 429 responses and a server-side rate limit are
+# configurable, so the geocoders' retry, backoff and rate control can be exercised offline.
+# Point the geocoders at it with ED_NOMINATIM_URL=http://127.0.0.1:8088
+
+import argparse
+import csv
+import json
+import random
+import threading
+import time
+import urllib.parse
+import zlib
+from collections import Counter
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from address import canonical_key, split_address
+from gazetteer import load_gazetteer
+
+class StubConfig:
+    """Behaviour of the stand-in server; can be changed while it runs."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, rate_limit=None, retry_after=1, error_status=503):
+        self.latency = latency              # seconds added to every answer
+        self.jitter = jitter                # extra random latency, uniform in [0, jitter]
+        self.error_rate = error_rate        # fraction of requests answered with HTTP error_status
+        self.throttle_rate = throttle_rate  # fraction of requests answered with HTTP 429
+        self.rate_limit = rate_limit        # requests per second above which HTTP 429 is returned
+        self.retry_after = retry_after      # Retry-After header of the 429 responses
+        self.error_status = error_status    # status of the random errors: 503, or 500/502 (any 5xx)
+
+class NominatimStub(ThreadingHTTPServer):
+    """Threaded HTTP server answering /search and /status like Nominatim."""
+
+    daemon_threads = True
+
+    def __init__(self, address, places, gazetteer=None, config=None):
+        super().__init__(address, NominatimHandler)
+        self.places = places
+        self.gazetteer = gazetteer
+        self.config = config or StubConfig()
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._window = (0, 0)  # (second, requests in that second)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def over_rate_limit(self):
+        if not self.config.rate_limit:
+            return False
+        with self._lock:
+            second, requests = self._window
+            now = int(time.monotonic())
+            requests = requests + 1 if now == second else 1
+            self._window = (now, requests)
+            return requests > self.config.rate_limit
+
+    def search(self, query):
+        """Return the Nominatim results of a query: a list with at most one place."""
+        key = canonical_key(split_address(query))
+        found = self.places.get(key)
+        if found is None and self.gazetteer:
+            found = self.gazetteer.lookup(key)
+        if found is None:
+            return []
+        latitude, longitude = found[:2]
+        return [{'place_id': zlib.crc32(key.encode('utf-8')), 'lat': str(latitude), 'lon': str(longitude),
+                 'display_name': query, 'class': 'boundary', 'type': 'administrative', 'importance': 0.5}]
+
+class NominatimHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        config = server.config
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(url.query)
+
+        if url.path.rstrip('/') == '/status':
+            self.send_json(200, {'status': 0, 'message': 'OK', 'stats': dict(server.stats)})
+            return
+        if url.path.rstrip('/') != '/search':
+            server.count('404')
+            self.send_json(404, {'error': 'not found'})
+            return
+
+        server.count('requests')
+        if config.latency or config.jitter:
+            time.sleep(config.latency + random.uniform(0, config.jitter))
+
+        if server.over_rate_limit() or random.random() < config.throttle_rate:
+            server.count('429')
+            self.send_json(429, {'error': 'Too Many Requests'}, {'Retry-After': str(config.retry_after)})
+            return
+        if random.random() < config.error_rate:
+            server.count(str(config.error_status))
+            self.send_json(config.error_status, {'error': HTTPStatus(config.error_status).phrase})
+            return
+        if params.get('format', ['xml'])[0] not in ('json', 'jsonv2'):
+            server.count('400')
+            self.send_json(400, {'error': 'only format=json is supported'})
+            return
+
+        results = server.search(params.get('q', [''])[0])
+        server.count('found' if results else 'not found')
+        self.send_json(200, results)
+
+def load_places(csv_file):
+    """Read address, latitude, longitude rows into a canonical key -> (latitude, longitude) dict."""
+    places = {}
+    with open(csv_file, mode='r', newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            try:
+                places[canonical_key(split_address(row[0]))] = (float(row[1]), float(row[2]))
+            except ValueError:
+                continue  # header or bad coordinates
+    return places
+
+def start_server(places, gazetteer=None, config=None, host='127.0.0.1', port=0):
+    """Start a stand-in server in a background thread and return it (server.url is its base URL)."""
+    server = NominatimStub((host, port), places, gazetteer, config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a Nominatim-compatible /search API from a fixture gazetteer.")
+    parser.add_argument('--fixture', default='addresses_geocoded.csv', help="CSV of address, latitude, longitude rows.")
+    parser.add_argument('--gazetteer', default=None, help="Level-3 boundary GeoJSON to answer commune queries from.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8088)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every answer.")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Extra random latency in seconds.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with an HTTP error.")
+    parser.add_argument('--error-status', type=int, default=503, choices=(500, 502, 503, 504), help="HTTP status of those errors.")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of requests answered with HTTP 429.")
+    parser.add_argument('--rate-limit', type=float, default=None, help="Requests per second above which HTTP 429 is returned.")
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency, args.jitter, args.error_rate, args.throttle_rate, args.rate_limit, error_status=args.error_status)
+    gazetteer = load_gazetteer(args.gazetteer) if args.gazetteer else None
+    server = NominatimStub((args.host, args.port), load_places(args.fixture), gazetteer, config)
+    print(f"Serving {len(server.places)} places on {server.url} (ED_NOMINATIM_URL={server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped.")
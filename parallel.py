@@ -0,0 +1,70 @@
+# Process pool for the CPU-bound stages of xls2csv.py and xls2geojson.py
+# Parsing workbooks, converting VNI text, normalizing dates and building features run in
+# worker processes, one workbook (or one row shard of a large workbook) per task, while
+# geocoding and database writes stay in the main process, behind its single rate limiter,
+# geocode cache and MongoDB writer. Results come back in the order the tasks were given,
+# whatever order the workers finish in, so a parallel run produces the same output as a
+# serial one. At most two tasks per worker are in flight, so memory use does not grow with
+# the size of the archive.
+
+import os
+import signal
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+# Worker processes used when none is given (1 runs everything in the main process)
+DEFAULT_PROCESSES = int(os.environ.get('ED_PROCESSES', 1))
+
+# Rows of a workbook per feature-building task
+DEFAULT_SHARD_ROWS = 5000
+
+def _ignore_sigint():
+    # Ctrl+C is handled by the main process, which stops submitting and lets the workers finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+class WorkerPool:
+    """Ordered map over a process pool, or in the main process when processes is 1.
+
+    processes 0 or None: one worker per CPU. func and the items must be picklable
+    (module-level functions, partials of them, DataFrames, ...).
+    """
+
+    def __init__(self, processes=DEFAULT_PROCESSES):
+        self.processes = processes or os.cpu_count()
+        self._executor = None
+        if self.processes > 1:
+            self._executor = ProcessPoolExecutor(max_workers=self.processes, initializer=_ignore_sigint)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def imap(self, func, items):
+        """Yield func(item) for each item, in order; the tasks are submitted as the results are consumed."""
+        if self._executor is None:
+            yield from map(func, items)
+            return
+
+        items = iter(items)
+        pending = deque(self._executor.submit(func, item) for item in islice(items, 2 * self.processes))
+        try:
+            while pending:
+                result = pending.popleft().result()
+                pending.extend(self._executor.submit(func, item) for item in islice(items, 1))
+                yield result
+        finally:
+            # The consumer stopped early: drop the tasks that have not started
+            for future in pending:
+                future.cancel()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+def row_shards(df, shard_rows=DEFAULT_SHARD_ROWS):
+    """Split a DataFrame into consecutive slices of at most shard_rows rows."""
+    return [df.iloc[start:start + shard_rows] for start in range(0, len(df), shard_rows)]
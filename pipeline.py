@@ -0,0 +1,210 @@
+# End-to-end pipeline: line-listing workbooks -> level-2 addresses -> affected cases -> geocoded cases
+# The stages of the chain of scripts (xls2geojson.py's workbook preparation, l2addr.py,
+# affected_case_filter.py and the geocoders) run in one process as a small DAG, passing
+# DataFrames from stage to stage instead of writing and parsing a CSV at each step.
+# Every stage result is cached (Feather, see workbookcache.save_frame) under a key made from
+# the stage, its parameters, the content of its input files and the keys of the stages it
+# reads, so a rerun only recomputes the stages whose inputs changed, and the ones after them.
+# Bump PIPELINE_VERSION when the code of a stage changes the results it gives.
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import signal
+from functools import partial
+import pandas as pd
+from vnconvert import apply_unique_columns, file_hash
+from workbookcache import load_frame, read_workbook, save_frame
+from parallel import DEFAULT_PROCESSES, WorkerPool
+from linelist import normalize_dates
+from l2addr import INPUT_COLUMNS, build_l2addr
+from affected_case_filter import add_case_year, filter_affected, load_rules
+from address import geocode_unique, split_address
+from geocache import GeoCache, DEFAULT_CACHE_FILE
+from geocoder import GeocodingEngine
+from gazetteer import load_gazetteer, DEFAULT_GAZETTEER_FILE
+from geojsonstream import GeoJSONWriter
+from xls2geojson import has_required_columns, vni2unicode
+
+# Version of the stage code, part of every cache key
+PIPELINE_VERSION = 1
+
+# Default folder of the stage cache
+DEFAULT_CACHE_DIR = os.environ.get('ED_PIPELINE_CACHE', '.pipeline_cache')
+
+# Flag to handle graceful shutdown
+stop_flag = False
+
+class Stage:
+    """A step of the pipeline: func(*results of deps, **params) returns a DataFrame.
+
+    files are the input files read by func; their content is part of the cache key.
+    A stage with cache=False is always run (its result is still passed on).
+    """
+
+    def __init__(self, name, func, deps=(), params=None, files=(), cache=True):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.params = params or {}
+        self.files = list(files)
+        self.cache = cache
+
+class Pipeline:
+    """Run a DAG of stages, reusing the cached result of every stage whose key did not change."""
+
+    def __init__(self, stages, cache_dir=DEFAULT_CACHE_DIR, force=()):
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_dir = cache_dir
+        self.force = set(force)
+        self.keys = {}
+        self.results = {}
+
+    def key(self, name):
+        """Cache key of a stage: its name, parameters, input file hashes and the keys of its dependencies."""
+        if name not in self.keys:
+            stage = self.stages[name]
+            description = {
+                'version': PIPELINE_VERSION,
+                'stage': name,
+                'params': stage.params,
+                'files': [(os.path.basename(path), file_hash(path)) for path in stage.files],
+                'deps': [self.key(dep) for dep in stage.deps],
+            }
+            text = json.dumps(description, sort_keys=True, ensure_ascii=False, default=str)
+            self.keys[name] = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return self.keys[name]
+
+    def run(self, name):
+        """Return the result of a stage, from memory, from the cache or by running it (and its dependencies)."""
+        if name in self.results:
+            return self.results[name]
+        stage = self.stages[name]
+        base = os.path.join(self.cache_dir, f"{name}.{self.key(name)}")
+
+        cached = load_frame(base) if stage.cache and name not in self.force else None
+        if cached is not None:
+            print(f"[{name}] cached ({len(cached[0])} rows)")
+            result = cached[0]
+        else:
+            inputs = [self.run(dep) for dep in stage.deps]
+            if stop_flag:
+                return None
+            print(f"[{name}] running ...")
+            result = stage.func(*inputs, **stage.params)
+            print(f"[{name}] {len(result)} rows")
+            # A stage cut short by Ctrl+C is not cached
+            if stage.cache and not stop_flag:
+                save_frame(base, result, {'stage': name}, prefix=name + '.')
+        self.results[name] = result
+        return result
+
+# Function to load and prepare one line-listing workbook (run in a worker process), None if it is not one
+def load_listing(file_path):
+    df, _ = read_workbook(file_path)
+    if not has_required_columns(df):
+        return None
+    # Convert VNI to Unicode, drop the rows without a name and convert the dates to ISO 8601
+    df = apply_unique_columns(df, vni2unicode)
+    df = df.dropna(subset=['Ho', 'Ten'], how='all')
+    return normalize_dates(df).assign(Workbook=os.path.basename(file_path))
+
+def workbooks_stage(files, processes=DEFAULT_PROCESSES):
+    """All the rows of the line-listing workbooks, in file name order."""
+    with WorkerPool(processes) as pool:
+        frames = [df for df in pool.imap(load_listing, files) if df is not None]
+    if not frames:
+        return pd.DataFrame(columns=INPUT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+def l2addr_stage(listing):
+    """The key fields and level-2 address of the cases, as l2addr.py writes them."""
+    # As text, the way l2addr.py reads its CSV
+    text = pd.DataFrame({column: listing[column].map(str).where(listing[column].notna()) for column in INPUT_COLUMNS})
+    return build_l2addr(text).reset_index(drop=True)
+
+def affected_stage(cases, rules_file, dedupe=False):
+    """The cases of the affected admin units and periods, as affected_case_filter.py selects them."""
+    cases = add_case_year(cases.copy())
+    return filter_affected(cases, load_rules(rules_file), dedupe).reset_index(drop=True)
+
+def geocode_stage(cases, geocache_file=DEFAULT_CACHE_FILE, gazetteer_file=DEFAULT_GAZETTEER_FILE, rate_limit=1, workers=4):
+    """The cases with the latitude, longitude and level of their level-2 address (missing when unresolved)."""
+    engine = GeocodingEngine(rate_limit, workers, user_agent="edgcoder_pipeline")
+    signal.signal(signal.SIGINT, lambda sig, frame: stop(engine))
+    try:
+        with GeoCache(geocache_file) as cache:
+            geocoded = geocode_unique(cases, ['L2Addr'], split_address, engine.geocode, cache,
+                                      should_stop=lambda: stop_flag, mapper=engine.map, gazetteer=load_gazetteer(gazetteer_file))
+    finally:
+        engine.close()
+    return cases.assign(latitude=geocoded['latitude'], longitude=geocoded['longitude'], geocode_level=geocoded['geocode_level'])
+
+def stop(engine):
+    global stop_flag
+    stop_flag = True
+    engine.cancel()
+    print("\nGracefully stopping the pipeline. Please wait...")
+
+def build_pipeline(folder_path, rules_file=None, dedupe=False, geocache_file=DEFAULT_CACHE_FILE,
+                   gazetteer_file=DEFAULT_GAZETTEER_FILE, rate_limit=1, workers=4, processes=DEFAULT_PROCESSES):
+    """The stages of a run; the affected-case filter is left out without a rules file."""
+    files = sorted(glob.glob(os.path.join(folder_path, '*.xlsx')) + glob.glob(os.path.join(folder_path, '*.xls')))
+    stages = [
+        # The workbook files are the input; the number of processes does not change the result
+        Stage('workbooks', lambda: workbooks_stage(files, processes), files=files),
+        Stage('l2addr', l2addr_stage, deps=['workbooks']),
+    ]
+    cases = 'l2addr'
+    if rules_file:
+        stages.append(Stage('affected', affected_stage, deps=['l2addr'], params={'rules_file': rules_file, 'dedupe': dedupe},
+                            files=[rules_file]))
+        cases = 'affected'
+    # The rate limit does not change the result, and the content of the geocode cache and of the
+    # gazetteer is not part of the key: rerun with --force geocode to pick up their changes
+    stages.append(Stage('geocode', partial(geocode_stage, rate_limit=rate_limit, workers=workers), deps=[cases],
+                        params={'geocache_file': geocache_file, 'gazetteer_file': gazetteer_file}))
+    return stages
+
+def save_outputs(geocoded, output_csv, failed_csv=None, geojson_file=None):
+    """Write the geocoded cases, the unresolved ones and (optionally) the geocoded cases as GeoJSON points."""
+    resolved = geocoded['latitude'].notna()
+    geocoded[resolved].to_csv(output_csv, index=False)
+    if failed_csv:
+        geocoded[~resolved].drop(columns=['latitude', 'longitude', 'geocode_level']).to_csv(failed_csv, index=False)
+    if geojson_file:
+        properties = geocoded[resolved].drop(columns=['latitude', 'longitude']).astype(object).to_dict('records')
+        with GeoJSONWriter(geojson_file) as writer:
+            for (lon, lat), row in zip(geocoded.loc[resolved, ['longitude', 'latitude']].itertuples(index=False, name=None), properties):
+                # Properties as strings (dates included), missing values as null
+                row = {name: None if pd.isna(value) else str(value) for name, value in row.items()}
+                writer.write({"type": "Feature", "geometry": {"type": "Point", "coordinates": [lon, lat]}, "properties": row})
+    return int(resolved.sum()), int((~resolved).sum())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the workbook -> address -> affected cases -> geocoding pipeline in memory.")
+    parser.add_argument('folder_path', nargs='?', default='./casedata', help="The folder containing the line-listing workbooks.")
+    parser.add_argument('--rules', default=None, help="Affected regions CSV (see affected_case_filter.py); all cases are geocoded without it.")
+    parser.add_argument('--dedupe', action='store_true', help="Keep a case matching several affected-region rules only once.")
+    parser.add_argument('--output', default='cases_geocoded.csv', help="CSV of the geocoded cases.")
+    parser.add_argument('--failed', default='cases_failed.csv', help="CSV of the cases that could not be geocoded.")
+    parser.add_argument('--geojson', default=None, help="Also write the geocoded cases as GeoJSON points (.geojsonl for GeoJSONSeq, .gz to compress).")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_FILE, help="The geocode cache database shared by all geocoders.")
+    parser.add_argument('--gazetteer', default=DEFAULT_GAZETTEER_FILE, help="The level-3 boundary GeoJSON used to geocode communes offline.")
+    parser.add_argument('--rate-limit', type=float, default=1, help="Nominatim requests per second.")
+    parser.add_argument('--workers', type=int, default=4, help="Concurrent Nominatim requests.")
+    parser.add_argument('--processes', type=int, default=DEFAULT_PROCESSES, help="Worker processes preparing the workbooks (0: one per CPU).")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="Folder of the stage cache (default: ED_PIPELINE_CACHE or .pipeline_cache).")
+    parser.add_argument('--force', nargs='*', default=[], help="Stages to run again even if their result is cached.")
+    args = parser.parse_args()
+
+    stages = build_pipeline(args.folder_path, args.rules, args.dedupe, args.cache, args.gazetteer, args.rate_limit, args.workers, args.processes)
+    pipeline = Pipeline(stages, args.cache_dir, args.force)
+    geocoded = pipeline.run('geocode')
+    if stop_flag or geocoded is None:
+        print("Stopped: the stages finished so far are cached, run again to resume")
+    else:
+        success, failed = save_outputs(geocoded, args.output, args.failed, args.geojson)
+        print(f"{success} geocoded cases saved to {args.output}, {failed} failed")
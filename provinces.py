@@ -0,0 +1,55 @@
+# Province codes (MaTinh) of the line listings and the province names they stand for
+# The codes of the 13 Mekong Delta provinces are built in. Codes of the other provinces are
+# read from a CSV of MaTinh,Tinh rows (ED_PROVINCE_CODES, province_codes.csv by default) when
+# the file exists, so every code seen in the listings can be added without touching the code.
+# The table is built once at import; province_names maps a whole column through a categorical,
+# so each distinct code is looked up once whatever the number of rows.
+
+import csv
+import os
+import numpy as np
+import pandas as pd
+
+# Default province code file, can be overridden with the ED_PROVINCE_CODES environment variable
+DEFAULT_PROVINCE_CODES_FILE = os.environ.get('ED_PROVINCE_CODES', 'province_codes.csv')
+
+# Built-in codes of the Mekong Delta provinces
+MEKONG_PROVINCES = {
+    "AGG": "An Giang",
+    "BLU": "Bạc Liêu",
+    "BTE": "Bến Tre",
+    "CMU": "Cà Mau",
+    "CTO": "Cần Thơ",
+    "DTP": "Đồng Tháp",
+    "HGG": "Hậu Giang",
+    "KGG": "Kiên Giang",
+    "LAN": "Long An",
+    "STG": "Sóc Trăng",
+    "TGG": "Tiền Giang",
+    "THV": "Trà Vinh",
+    "VLG": "Vĩnh Long",
+}
+
+def load_province_table(csv_file=DEFAULT_PROVINCE_CODES_FILE):
+    """Return the code -> name table: the built-in codes, plus (or overridden by) the rows of csv_file if it exists."""
+    table = dict(MEKONG_PROVINCES)
+    if csv_file and os.path.exists(csv_file):
+        with open(csv_file, mode='r', newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                if row.get('MaTinh') and row.get('Tinh'):
+                    table[row['MaTinh'].strip()] = row['Tinh'].strip()
+    return table
+
+# Table of the run, the categorical dtype of its codes and the names in category order
+# (followed by '' for the codes that are not in the table)
+PROVINCES = load_province_table()
+PROVINCE_CODES = pd.CategoricalDtype(sorted(PROVINCES))
+_NAMES = np.array([PROVINCES[code] for code in PROVINCE_CODES.categories] + [''], dtype=object)
+
+def map_ma_tinh(ma_tinh):
+    """Name of a province code, '' for an unknown code."""
+    return PROVINCES.get(ma_tinh, "")
+
+def province_names(codes):
+    """Names of a Series of province codes ('' for unknown codes), looked up once per code."""
+    return pd.Series(_NAMES[codes.astype(PROVINCE_CODES).cat.codes.to_numpy()], index=codes.index, dtype=object)
@@ -0,0 +1,143 @@
+# Hierarchical geocoding fallback of address.geocode_with_fallback, with an in-memory cache
+
+from types import SimpleNamespace
+import pytest
+import numpy as np
+import pandas as pd
+from address import address_parts, canonical_component, canonical_key, geocode_unique, geocode_with_fallback
+from geocache import GeoCache, NOT_FOUND
+from gazetteer import Gazetteer
+from geocoder import GeocodingError
+
+ADDRESS = address_parts(xa='Xã Mỹ Hòa', huyen='Huyện Chợ Mới', tinh='An Giang')
+COMMUNE, DISTRICT, PROVINCE = (canonical_key(ADDRESS[number:]) for number in range(3))
+
+class FakeGeocoder:
+    """Answer the queries starting with a known name, raise GeocodingError for the failing ones."""
+
+    def __init__(self, found=(), failing=()):
+        self.found = dict(found)
+        self.failing = failing
+        self.queries = []
+
+    def __call__(self, query):
+        self.queries.append(query)
+        if query.startswith(self.failing):
+            raise GeocodingError('GeocoderServiceError: 502')
+        for name, (latitude, longitude) in self.found.items():
+            if query.startswith(name):
+                return SimpleNamespace(latitude=latitude, longitude=longitude)
+        return None
+
+@pytest.fixture
+def cache():
+    with GeoCache(':memory:') as cache:
+        yield cache
+
+def test_canonical_key_ignores_spelling():
+    assert COMMUNE == 'an giang|cho moi|my hoa'
+    assert canonical_key(address_parts(xa='XÃ  MỸ HÒA', huyen='H. Chợ Mới', tinh='Tỉnh An Giang')) == COMMUNE
+
+@pytest.mark.parametrize('name, prefixed', [
+    ('Tịnh Biên', ['Huyện Tịnh Biên', 'Thị xã Tịnh Biên', 'THỊ XÃ Tịnh Biên']),
+    ('Quan Sơn', ['Huyện Quan Sơn', 'Quận Quan Sơn']),
+    ('Xà Phiên', ['Xã Xà Phiên']),
+    ('Tô Châu', ['Phường Tô Châu']),
+    ('Thị Trấn', ['Thị trấn Thị Trấn']),
+])
+def test_names_starting_like_a_prefix(name, prefixed):
+    # Only the prefixes written with their diacritics are removed, so the name keeps its first syllable
+    assert len(canonical_component(name).split()) == 2
+    assert {canonical_component(value) for value in prefixed} == {canonical_component(name)}
+
+def test_gazetteer_finds_prefixed_names():
+    square = {'type': 'Polygon', 'coordinates': [[[105.0, 10.5], [105.1, 10.5], [105.1, 10.6], [105.0, 10.6], [105.0, 10.5]]]}
+    gazetteer = Gazetteer([{'type': 'Feature', 'geometry': square,
+                            'properties': {'NAME_3': 'Nhơn Hưng', 'NAME_2': 'Tịnh Biên', 'NAME_1': 'An Giang'}}])
+    for huyen in ('Tịnh Biên', 'Huyện Tịnh Biên', 'Thị xã Tịnh Biên'):
+        assert gazetteer.lookup(canonical_key(address_parts(huyen=huyen, tinh='An Giang'))) is not None
+        assert gazetteer.lookup(canonical_key(address_parts(xa='Xã Nhơn Hưng', huyen=huyen, tinh='An Giang'))) is not None
+
+def test_most_specific_level(cache):
+    geocode = FakeGeocoder(found={'Xã Mỹ Hòa': (10.4, 105.5)})
+    assert geocode_with_fallback(ADDRESS, geocode, cache) == (10.4, 105.5, 'xa')
+    assert cache.lookup(COMMUNE) == (10.4, 105.5, 'xa')
+    # Cached: no second request
+    assert geocode_with_fallback(ADDRESS, geocode, cache) == (10.4, 105.5, 'xa')
+    assert len(geocode.queries) == 1
+
+def test_falls_back_when_not_found(cache):
+    geocode = FakeGeocoder(found={'Huyện Chợ Mới': (10.5, 105.4)})
+    assert geocode_with_fallback(ADDRESS, geocode, cache) == (10.5, 105.4, 'huyen')
+    # The commune is cached with the district it resolved to
+    assert cache.lookup(COMMUNE) == (10.5, 105.4, 'huyen')
+    assert cache.lookup(DISTRICT) == (10.5, 105.4, 'huyen')
+
+def test_not_found_anywhere(cache):
+    geocode = FakeGeocoder()
+    assert geocode_with_fallback(ADDRESS, geocode, cache) is None
+    assert len(geocode.queries) == 3
+    assert [cache.failure(key) for key in (COMMUNE, DISTRICT, PROVINCE)] == [NOT_FOUND] * 3
+
+def test_request_error_stops_the_fallback(cache):
+    geocode = FakeGeocoder(found={'Huyện Chợ Mới': (10.5, 105.4), 'An Giang': (10.5, 105.1)}, failing='Xã Mỹ Hòa')
+    with pytest.raises(GeocodingError):
+        geocode_with_fallback(ADDRESS, geocode, cache)
+    assert len(geocode.queries) == 1
+    assert cache.lookup(DISTRICT) is None
+    assert cache.failure(COMMUNE) not in (None, NOT_FOUND)
+
+    # Still no coarser result while the error is recent, and no new request
+    with pytest.raises(GeocodingError, match='502'):
+        geocode_with_fallback(ADDRESS, geocode, cache)
+    assert len(geocode.queries) == 1
+
+def test_request_error_after_a_level_not_found(cache):
+    geocode = FakeGeocoder(found={'An Giang': (10.5, 105.1)}, failing='Huyện Chợ Mới')
+    with pytest.raises(GeocodingError):
+        geocode_with_fallback(ADDRESS, geocode, cache)
+    assert cache.failure(COMMUNE) == NOT_FOUND
+    assert cache.lookup(PROVINCE) is None
+
+def test_error_retried_once_expired(cache):
+    cache.error_ttl = 0
+    geocode = FakeGeocoder(failing='Xã Mỹ Hòa')
+    with pytest.raises(GeocodingError):
+        geocode_with_fallback(ADDRESS, geocode, cache)
+    geocode.failing = ()
+    geocode.found = {'Xã Mỹ Hòa': (10.4, 105.5)}
+    assert geocode_with_fallback(ADDRESS, geocode, cache) == (10.4, 105.5, 'xa')
+
+def test_gazetteer_before_geocoder(cache):
+    gazetteer = SimpleNamespace(lookup=lambda key: (10.4, 105.5, 'xa') if key == COMMUNE else None)
+    geocode = FakeGeocoder()
+    assert geocode_with_fallback(ADDRESS, geocode, cache, gazetteer) == (10.4, 105.5, 'xa')
+    assert geocode.queries == []
+
+def test_geocode_unique_broadcasts(cache):
+    df = pd.DataFrame({'Xa': ['Xã Mỹ Hòa', 'Mỹ Hòa', np.nan], 'Huyen': ['Chợ Mới'] * 3, 'Tinh': ['An Giang'] * 3},
+                      index=[10, 11, 12])
+    geocode = FakeGeocoder(found={'Xã Mỹ Hòa': (10.4, 105.5), 'Chợ Mới': (10.5, 105.4)})
+    geocoded = geocode_unique(df, ['Xa', 'Huyen', 'Tinh'], lambda xa, huyen, tinh: address_parts(xa=xa, huyen=huyen, tinh=tinh),
+                              geocode, cache)
+    assert geocoded.index.tolist() == [10, 11, 12]
+    assert geocoded['geocode_level'].tolist() == ['xa', 'xa', 'huyen']
+    # The two spellings of the commune share one request
+    assert len(geocode.queries) == 2
+
+def test_geocode_unique_empty(cache):
+    # A fully processed workbook: no rows left, and an all-NaN (float64) key column
+    df = pd.DataFrame({'Xa': [np.nan], 'Huyen': ['Chợ Mới'], 'Tinh': ['An Giang']}).iloc[[]]
+    geocode = FakeGeocoder()
+    geocoded = geocode_unique(df, ['Xa', 'Huyen', 'Tinh'], lambda xa, huyen, tinh: address_parts(xa=xa, huyen=huyen, tinh=tinh),
+                              geocode, cache)
+    assert geocoded.empty and geocode.queries == []
+    assert geocoded.columns.tolist() == ['geocode_query', 'latitude', 'longitude', 'geocode_level']
+    assert not geocoded['latitude'].notna().any()
+
+def test_geocode_unique_failed_request(cache):
+    df = pd.DataFrame({'Xa': ['Xã Mỹ Hòa'], 'Huyen': ['Chợ Mới'], 'Tinh': ['An Giang']})
+    geocode = FakeGeocoder(found={'Chợ Mới': (10.5, 105.4)}, failing='Xã Mỹ Hòa')
+    geocoded = geocode_unique(df, ['Xa', 'Huyen', 'Tinh'], lambda xa, huyen, tinh: address_parts(xa=xa, huyen=huyen, tinh=tinh),
+                              geocode, cache)
+    assert geocoded['latitude'].isna().all()
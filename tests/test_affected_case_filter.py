@@ -0,0 +1,93 @@
+# The join-based affected-region filter against a row-by-row reference, and the streaming
+# mode against the in-memory one
+
+import random
+import pandas as pd
+import pytest
+from affected_case_filter import RULE_LEVELS, filter_affected, load_cases, load_rules, stream_affected
+
+PLACES = [('An Giang', 'Chợ Mới', 'Mỹ Hòa'), ('An Giang', 'Chợ Mới', 'Kiến An'), ('An Giang', 'Tân Châu', 'Long Sơn'),
+          ('Bạc Liêu', 'Giá Rai', 'Phong Thạnh'), ('Bạc Liêu', 'Giá Rai', 'Tân Phong'), ('Sóc Trăng', 'Long Phú', 'Long Đức')]
+
+RULES = """﻿Year,Start,End,Affected_Province,Affected_District,Affected_Commune
+2003,,,Bạc Liêu,Giá Rai,
+,2004-03-01,2004-06-30,An Giang,Chợ Mới,
+2005,,,An Giang,Chợ Mới,Kiến An
+,2003-01-01,,Sóc Trăng,,
+2004,,2004-12-31,An Giang,,
+,,,,,
+2002,,,Cà Mau,Năm Căn,
+"""
+
+@pytest.fixture
+def files(tmp_path):
+    rng = random.Random(0)
+    dates = pd.date_range('2002-06-01', '2006-06-01', freq='7D').strftime('%Y-%m-%dT%H:%M:%S').tolist() + ['', 'không rõ']
+    rows = []
+    for number in range(300):
+        tinh, huyen, xa = rng.choice(PLACES)
+        rows.append({'MaSo': f'C{number:04d}', 'Tinh': tinh, 'Huyen': huyen, 'Xa': xa,
+                     'VaoVien': rng.choice(dates), 'RaVien': rng.choice(dates), 'GhiChu': rng.choice(['', 'x, "y"'])})
+    cases_file = tmp_path / 'cases.csv'
+    pd.DataFrame(rows).to_csv(cases_file, index=False)
+    rules_file = tmp_path / 'rules.csv'
+    rules_file.write_text(RULES, encoding='utf-8')
+    return cases_file, rules_file, tmp_path
+
+def reference(cases, rules, dedupe=False):
+    """MaSo of the matching cases, rule by rule then case by case, checking every pair."""
+    dates = cases[['VaoVien', 'RaVien']].max(axis=1)
+    selected = []
+    for _, rule in rules.iterrows():
+        named = [column for column in RULE_LEVELS if pd.notna(rule.get(column))]
+        if not named:
+            continue
+        for index, case in cases.iterrows():
+            if any(case[RULE_LEVELS[column]] != rule[column] for column in named):
+                continue
+            if pd.notna(rule.get('Year')) and not case['Year'] <= rule['Year']:
+                continue
+            if pd.notna(rule.get('Start')) and not dates[index] >= rule['Start']:
+                continue
+            if pd.notna(rule.get('End')) and not dates[index] < rule['End'] + pd.Timedelta(days=1):
+                continue
+            selected.append(case['MaSo'])
+    return list(dict.fromkeys(selected)) if dedupe else selected
+
+@pytest.mark.parametrize('dedupe', [False, True])
+def test_filter_matches_reference(files, dedupe):
+    cases_file, rules_file, _ = files
+    cases, rules = load_cases(cases_file), load_rules(rules_file)
+    expected = reference(cases, rules, dedupe)
+    assert expected  # the fixture exercises the filter
+    assert filter_affected(cases, rules, dedupe)['MaSo'].tolist() == expected
+
+def test_no_rule_matches(files):
+    cases_file, _, tmp_path = files
+    rules_file = tmp_path / 'none.csv'
+    rules_file.write_text('Year,Affected_Province,Affected_District\n2003,Cà Mau,Năm Căn\n', encoding='utf-8')
+    assert filter_affected(load_cases(cases_file), load_rules(rules_file)).empty
+
+@pytest.mark.parametrize('dedupe', [False, True])
+@pytest.mark.parametrize('chunk_size', [1000, 64, 7])
+def test_stream_matches_in_memory(files, dedupe, chunk_size):
+    cases_file, rules_file, tmp_path = files
+    rules = load_rules(rules_file)
+    in_memory = filter_affected(load_cases(cases_file), rules, dedupe)
+
+    output_file = tmp_path / 'streamed.csv'
+    count = stream_affected(rules, cases_file, output_file, dedupe, chunk_size)
+    streamed = pd.read_csv(output_file, dtype=str, keep_default_na=False)
+    assert count == len(streamed) == len(in_memory)
+
+    # Rows come out chunk by chunk: the same rows, in the same order within a single chunk
+    key = lambda df: list(zip(df['MaSo'], df['Year'].astype(str)))
+    in_memory = in_memory.assign(Year=in_memory['Year'].astype('Int64'))
+    if chunk_size >= len(streamed):
+        assert key(streamed) == key(in_memory)
+    else:
+        assert sorted(key(streamed)) == sorted(key(in_memory))
+
+    # The other columns are written back unchanged
+    original = pd.read_csv(cases_file, dtype=str, keep_default_na=False).set_index('MaSo')
+    assert (streamed.set_index('MaSo').drop(columns='Year') == original.loc[streamed['MaSo']]).all().all()
@@ -0,0 +1,42 @@
+# Date filters and per-period counts of casequery, on a mongomock collection
+
+import mongomock
+import pytest
+from casequery import build_filter, cases_dataframe, count_cases
+
+CASES = [
+    ('C1', 'An Giang', '2020-01-15T00:00:00'),
+    ('C2', 'An Giang', '2020-02-10T00:00:00'),
+    ('C3', 'Bạc Liêu', '2020-03-05T00:00:00'),
+    ('C4', 'Bạc Liêu', ''),
+    ('C5', 'An Giang', None),
+]
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient().edengue.cases
+    collection.insert_many([{'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [105.4, 10.4]},
+                             'properties': {'patient': {'id': patient}, 'address': {'level1': province},
+                                            'meta': {'VaoVien': admitted}}}
+                            for patient, province, admitted in CASES])
+    return collection
+
+def patients(collection, **filters):
+    return sorted(cases_dataframe(collection, **filters)['patient_id'])
+
+def test_date_bounds_leave_out_missing_dates(collection):
+    assert patients(collection, end='2020-03-01') == ['C1', 'C2']
+    assert patients(collection, start='2020-02-01') == ['C2', 'C3']
+    assert patients(collection, start='2020-02-01', end='2020-03-01') == ['C2']
+    assert patients(collection) == ['C1', 'C2', 'C3', 'C4', 'C5']
+
+def test_build_filter_end_only():
+    assert build_filter(end='2020-03-01') == {'properties.meta.VaoVien': {'$gt': '', '$lt': '2020-03-01'}}
+
+def test_count_cases_per_period(collection):
+    counts = count_cases(collection, by=('level1',), period='month')
+    assert counts.to_dict('records') == [{'level1': 'An Giang', 'period': '2020-01', 'cases': 1},
+                                         {'level1': 'An Giang', 'period': '2020-02', 'cases': 1},
+                                         {'level1': 'Bạc Liêu', 'period': '2020-03', 'cases': 1}]
+    # Without a period every case is counted
+    assert count_cases(collection, by=('level1',), period=None)['cases'].tolist() == [3, 2]
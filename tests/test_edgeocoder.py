@@ -0,0 +1,68 @@
+# Resuming edgeocoder.py from its journal: only definitive results are replayed
+
+import json
+from types import SimpleNamespace
+import pandas as pd
+import pytest
+from geopy.exc import GeocoderQueryError
+import edgeocoder
+from geocoder import GeocodingEngine
+from journal import Journal
+
+ADDRESSES = ['Xã Mỹ Hòa, Huyện Chợ Mới, An Giang', 'Xã Lỗi, Huyện Lỗi, Bạc Liêu', 'Xã Không, Huyện Không, Tỉnh Không']
+
+class FakeGeolocator:
+    """Find Mỹ Hòa, fail the requests starting with one of failing, find nothing else."""
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.queries = []
+
+    def geocode(self, query, timeout=None):
+        self.queries.append(query)
+        if query.startswith(self.failing):
+            raise GeocoderQueryError('400')
+        if query.startswith('Xã Mỹ Hòa'):
+            return SimpleNamespace(latitude=10.4, longitude=105.5)
+        return None
+
+class KeptJournal(Journal):
+    """A journal left in place at the end of a run, as after Ctrl+C, so it can be inspected."""
+
+    def remove(self):
+        self.close()
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    input_csv = tmp_path / 'addresses.csv'
+    pd.DataFrame({'address': ADDRESSES}).to_csv(input_csv, index=False)
+    monkeypatch.setattr(edgeocoder, 'Journal', KeptJournal)
+
+    def run(geolocator, retry_failures=False):
+        engine = GeocodingEngine(rate_limit=1000, workers=1, geolocator=geolocator, retries=0)
+        monkeypatch.setattr(edgeocoder, 'geocoding_engine', engine)
+        try:
+            edgeocoder.main(str(input_csv), str(tmp_path / 'geocache.sqlite'), None, retry_failures=retry_failures,
+                            failures_csv=str(tmp_path / 'failures.csv'), output_csv=str(tmp_path / 'geocoded.csv'),
+                            failed_csv=str(tmp_path / 'failed.csv'), journal_file=str(tmp_path / 'journal.jsonl'))
+        finally:
+            engine.close()
+            edgeocoder.geocache.close()
+        with open(tmp_path / 'journal.jsonl', encoding='utf-8') as f:
+            return [json.loads(line) for line in f][1:]
+
+    return run, tmp_path
+
+def test_failed_requests_are_not_journaled(run):
+    run, tmp_path = run
+    records = run(FakeGeolocator(failing='Xã Lỗi'))
+    assert [record['row'] for record in records] == [0, 2]
+    assert records[1]['latitude'] == 'NA'
+    assert pd.read_csv(tmp_path / 'failed.csv')['address'].tolist() == ADDRESSES[1:]
+
+    # The next run geocodes only the row whose request failed
+    geolocator = FakeGeolocator()
+    records = run(geolocator, retry_failures=True)
+    assert geolocator.queries == ['Xã Lỗi, Huyện Lỗi, Bạc Liêu, Việt Nam', 'Huyện Lỗi, Bạc Liêu, Việt Nam',
+                                  'Bạc Liêu, Việt Nam']
+    assert sorted(record['row'] for record in records) == [0, 1, 2]
@@ -0,0 +1,129 @@
+# Retry and circuit-breaker classification of the errors seen by GeocodingEngine
+# The geolocator is a stand-in raising the errors geopy raises for each HTTP answer, and
+# the breaker records what the engine reported to it; the last test goes through HTTP to
+# nominatim_stub.py.
+
+from types import SimpleNamespace
+import pytest
+from geopy.adapters import AdapterHTTPError
+from geopy.exc import (GeocoderAuthenticationFailure, GeocoderQueryError, GeocoderRateLimited,
+                       GeocoderServiceError, GeocoderTimedOut, GeocoderUnavailable)
+from geocoder import CircuitBreaker, GeocodingEngine, GeocodingError, is_retryable, is_server_error, is_unhealthy
+from nominatim_stub import StubConfig, start_server
+
+LOCATION = SimpleNamespace(latitude=10.03, longitude=105.78)
+
+def http_error(status):
+    """The GeocoderServiceError geopy raises for an HTTP status it has no better class for."""
+    error = GeocoderServiceError(f"Non-successful status code {status}")
+    error.__cause__ = AdapterHTTPError(str(error), status_code=status, headers={}, text='')
+    return error
+
+class RecordingBreaker:
+    """Circuit breaker that never pauses and records the outcomes it is told about."""
+
+    def __init__(self):
+        self.calls = []
+
+    def wait(self, cancelled=None):
+        return True
+
+    def success(self):
+        self.calls.append('success')
+
+    def error(self):
+        self.calls.append('error')
+
+class FakeGeolocator:
+    """Raise the given errors in turn, then return LOCATION."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.queries = []
+
+    def geocode(self, query, timeout=None):
+        self.queries.append(query)
+        if self.errors:
+            raise self.errors.pop(0)
+        return LOCATION
+
+@pytest.fixture
+def make_engine():
+    engines = []
+
+    def make(geolocator, retries=3):
+        engine = GeocodingEngine(rate_limit=1000, workers=1, geolocator=geolocator, retries=retries,
+                                 breaker=RecordingBreaker())
+        engine.backoff = lambda attempt, retry_after=None: 0
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.close()
+
+@pytest.mark.parametrize('status', [500, 502, 504])
+def test_server_errors_are_retried_and_unhealthy(make_engine, status):
+    engine = make_engine(FakeGeolocator(http_error(status), http_error(status)))
+    assert engine.geocode('Xã A, Việt Nam') is LOCATION
+    assert engine.breaker.calls == ['error', 'error', 'success']
+    assert engine.stats['retries'] == 2
+
+def test_timeouts_and_503_are_retried_and_unhealthy(make_engine):
+    engine = make_engine(FakeGeolocator(GeocoderTimedOut('timed out'), GeocoderUnavailable('503')))
+    assert engine.geocode('Xã A, Việt Nam') is LOCATION
+    assert engine.breaker.calls == ['error', 'error', 'success']
+
+def test_throttling_is_retried_but_healthy(make_engine):
+    engine = make_engine(FakeGeolocator(GeocoderRateLimited('429', retry_after=0)))
+    assert engine.geocode('Xã A, Việt Nam') is LOCATION
+    assert engine.breaker.calls == ['success', 'success']
+    assert engine.stats['retries'] == 1
+
+@pytest.mark.parametrize('error', [GeocoderQueryError('400'), GeocoderAuthenticationFailure('403'), http_error(404)],
+                         ids=['query', 'authentication', 'other 4xx'])
+def test_refused_queries_fail_at_once(make_engine, error):
+    geolocator = FakeGeolocator(error)
+    engine = make_engine(geolocator)
+    with pytest.raises(GeocodingError):
+        engine.geocode('Xã A, Việt Nam')
+    assert len(geolocator.queries) == 1
+    assert engine.breaker.calls == ['success']
+
+def test_exhausted_retries_raise(make_engine):
+    geolocator = FakeGeolocator(*[http_error(500)] * 3)
+    engine = make_engine(geolocator, retries=2)
+    with pytest.raises(GeocodingError, match='after 3 attempts'):
+        engine.geocode('Xã A, Việt Nam')
+    assert engine.breaker.calls == ['error'] * 3
+
+def test_classification():
+    assert is_server_error(http_error(502)) and not is_server_error(http_error(404))
+    assert not is_server_error(GeocoderQueryError('400'))
+    assert is_retryable(GeocoderRateLimited('429')) and not is_unhealthy(GeocoderRateLimited('429'))
+    assert is_retryable(http_error(500)) and is_unhealthy(http_error(500))
+    assert not is_retryable(GeocoderAuthenticationFailure('403'))
+
+def test_breaker_opens_after_threshold_errors():
+    breaker = CircuitBreaker(threshold=3, cooldown=60)
+    for _ in range(2):
+        breaker.error()
+    assert breaker.state == 'closed'
+    breaker.error()
+    assert breaker.state == 'open'
+    breaker.success()
+    assert breaker.state == 'closed'
+
+@pytest.mark.parametrize('status', [500, 502])
+def test_stub_server_errors_are_retried(status):
+    server = start_server({}, config=StubConfig(error_rate=1.0, error_status=status))
+    engine = GeocodingEngine(rate_limit=1000, workers=1, base_url=server.url, retries=1, breaker=RecordingBreaker())
+    engine.backoff = lambda attempt, retry_after=None: 0
+    try:
+        with pytest.raises(GeocodingError):
+            engine.geocode('Xã A, Việt Nam')
+    finally:
+        engine.close()
+        server.shutdown()
+    assert server.stats[str(status)] == 2
+    assert engine.breaker.calls == ['error', 'error']
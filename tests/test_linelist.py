@@ -0,0 +1,53 @@
+# Date normalization of the line-listing columns (linelist.normalize_dates)
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from linelist import normalize_date_column, normalize_dates
+
+@pytest.mark.parametrize('value, expected', [
+    (datetime(2022, 1, 3, 8, 30), '2022-01-03T08:30:00'),
+    (pd.Timestamp('2021-12-31'), '2021-12-31T00:00:00'),
+    (44562, '2022-01-01T00:00:00'),
+    (44562.75, '2022-01-01T00:00:00'),
+    ('44562', '2022-01-01T00:00:00'),
+    ('44562.0', '2022-01-01T00:00:00'),
+    ('31/12/2021', '2021-12-31T00:00:00'),
+    ('3/1/2022 10:15', '2022-01-03T00:00:00'),
+    # Excel's 1900 date system: serial 1 is 1900-01-01 and 60 is the non-existent 1900-02-29
+    (1, '1900-01-01T00:00:00'),
+    (59, '1900-02-28T00:00:00'),
+    (61, '1900-03-01T00:00:00'),
+    (60, '60'),
+    ('không rõ', 'không rõ'),
+    ('31/02/2021', '31/02/2021'),
+    (None, ''),
+    (np.nan, ''),
+])
+def test_values(value, expected):
+    # Mixed with other shapes, as in a column read by read_excel
+    series = pd.Series([value, '15/06/2020', 43000], dtype=object)
+    assert normalize_date_column(series).tolist() == [expected, '2020-06-15T00:00:00', '2017-09-22T00:00:00']
+
+def test_datetime_columns():
+    naive = pd.Series(pd.to_datetime(['2022-01-03 08:30', None, '2022-01-03 08:30']))
+    assert normalize_date_column(naive).tolist() == ['2022-01-03T08:30:00', '', '2022-01-03T08:30:00']
+    aware = naive.dt.tz_localize('Asia/Ho_Chi_Minh')
+    assert normalize_date_column(aware).tolist() == ['2022-01-03T08:30:00', '', '2022-01-03T08:30:00']
+
+def test_keeps_the_index():
+    series = pd.Series(['01/02/2022', None, '01/02/2022'], index=[7, 3, 5], dtype=object)
+    normalized = normalize_date_column(series)
+    assert normalized.index.tolist() == [7, 3, 5]
+    assert normalized.tolist() == ['2022-02-01T00:00:00', '', '2022-02-01T00:00:00']
+
+def test_normalize_dates():
+    df = pd.DataFrame({'VaoVien': ['01/02/2022', 44600], 'RaVien': [None, '05/02/2022'], 'Ten': ['44600', 'B']},
+                      dtype=object)
+    normalized = normalize_dates(df)
+    assert normalized['VaoVien'].tolist() == ['2022-02-01T00:00:00', '2022-02-08T00:00:00']
+    assert normalized['RaVien'].tolist() == ['', '2022-02-05T00:00:00']
+    # Other columns and the original frame are left alone; missing date columns are skipped
+    assert normalized['Ten'].tolist() == ['44600', 'B']
+    assert df['VaoVien'].tolist() == ['01/02/2022', 44600]
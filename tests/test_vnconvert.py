@@ -0,0 +1,75 @@
+# The compiled charset engines of vnconvert.Converter against the original two-pass
+# str.replace loop (vnconvert_bench.baseline_convert), on line-listing text and on random
+# strings built from the tables
+
+import random
+import pandas as pd
+import pytest
+from vnconvert import Converter, convert_series, detect_sample
+from vnconvert_bench import CHARSETS, baseline_convert, generate_cells
+
+CELLS = generate_cells(300)
+
+@pytest.fixture(scope='module')
+def converter():
+    return Converter()
+
+def fuzz_strings(converter, charset, count=300, seed=0):
+    """Random strings mixing entries of the charset's table with other characters of all the tables.
+
+    Colons and digits are left out: the baseline's '::number::' placeholders would collide with them.
+    """
+    rnd = random.Random(seed)
+    alphabet = set('abc AEOUYaeouy.,dD^+(`\'?~\\')
+    for name in CHARSETS:
+        alphabet.update(''.join(getattr(converter, name)))
+    alphabet = sorted(alphabet - set(':0123456789'))
+    pieces = [piece for piece in getattr(converter, charset) if not set(piece) & set(':0123456789')]
+    return [''.join(rnd.choice(pieces) if rnd.random() < 0.6 else rnd.choice(alphabet) for _ in range(rnd.randint(0, 15)))
+            for _ in range(count)]
+
+def baseline_decode(converter, charset, cells):
+    return [baseline_convert(getattr(converter, charset), converter.UNICODE, cell) for cell in cells]
+
+# The tables do not round-trip every cell (vnconvert_bench.py reports how many), so the
+# engines are held to the baseline's output rather than to the original text
+@pytest.mark.parametrize('charset', CHARSETS)
+def test_line_listing_text_matches_baseline(converter, charset):
+    encoded = [converter.getEngine('UNICODE', charset)(cell) for cell in CELLS]
+    assert encoded == [baseline_convert(converter.UNICODE, getattr(converter, charset), cell) for cell in CELLS]
+    assert [converter.getEngine(charset)(cell) for cell in encoded] == baseline_decode(converter, charset, encoded)
+
+@pytest.mark.parametrize('source', CHARSETS)
+def test_engines_match_baseline(converter, source):
+    strings = fuzz_strings(converter, source)
+    for target in CHARSETS:
+        engine = converter.getEngine(source, target)
+        source_table, target_table = getattr(converter, source), getattr(converter, target)
+        assert [engine(text) for text in strings] == [baseline_convert(source_table, target_table, text) for text in strings]
+
+def test_engines_are_shared(converter):
+    assert Converter().getEngine('VNI_WIN') is converter.getEngine('VNI_WIN')
+
+def test_source_only_charsets(converter):
+    assert converter.convert('Nguyễn', 'COMB_UNICODE') == 'Nguyễn'
+    assert converter.convert('Nguyễn'.encode('utf-8').decode('cp1252'), 'UTF8') == 'Nguyễn'
+    with pytest.raises(ValueError):
+        converter.getEngine('UNICODE', 'UTF8')
+
+@pytest.mark.parametrize('charset', ['VNI_WIN', 'TCVN3', 'VIQR'])
+def test_convert_series(converter, charset):
+    encode = converter.getEngine('UNICODE', charset)
+    encoded = [encode(cell) for cell in CELLS]
+    series = pd.Series(encoded + [None, 12], dtype=object)
+    assert convert_series(series, charset).tolist() == baseline_decode(converter, charset, encoded) + [None, 12]
+
+def test_detect_sample_prefers_non_ascii(converter, monkeypatch):
+    sampled = []
+    detect = Converter.detectCharset
+    monkeypatch.setattr(Converter, 'detectCharset', lambda self, text: sampled.append(text) or detect(self, text))
+
+    # All of a few VNI values among many plain ASCII ones are sampled, then ASCII values fill the sample
+    vni = list(dict.fromkeys(converter.getEngine('UNICODE', 'VNI_WIN')(cell) for cell in CELLS[:20]))
+    values = [f'MS{number:05d}' for number in range(5000)] + vni
+    assert detect_sample(values, sample_size=50) == ('VNI_WIN', 1.0)
+    assert len(sampled) == 50 and set(vni) <= set(sampled)
@@ -0,0 +1,35 @@
+# Parsed-workbook cache: a warm read must give the frame a cold parse gives
+
+import numpy as np
+import pandas as pd
+import pytest
+from workbookcache import read_workbook, write_workbook
+
+@pytest.fixture
+def workbook(tmp_path):
+    file_path = tmp_path / 'ED_2020.xlsx'
+    pd.DataFrame({'MaSo': [1, 2, np.nan], 'Ho': ['Nguyễn', 'Trần', None], 'VaoVien': pd.to_datetime(['2020-01-02', None, '2020-01-05'])},
+                 ).to_excel(file_path, sheet_name='DS', index=False)
+    return str(file_path), str(tmp_path / 'cache')
+
+def test_warm_read_matches_cold_parse(workbook):
+    file_path, cache_dir = workbook
+    cold, sheet_name = read_workbook(file_path, cache_dir, use_cache=False)
+    read_workbook(file_path, cache_dir)
+    warm, warm_sheet_name = read_workbook(file_path, cache_dir)
+    assert warm_sheet_name == sheet_name == 'DS'
+    pd.testing.assert_frame_equal(warm, cold)
+
+def test_rewritten_workbook_matches_cold_parse(workbook):
+    file_path, cache_dir = workbook
+    df, _ = read_workbook(file_path, cache_dir)
+    # As xls2geojson.py does: drop the rows without a name and mark the others; MaSo is float64 here
+    df = df.dropna(subset=['Ho']).assign(Processed=True)
+    assert df['MaSo'].dtype == np.float64
+    write_workbook(file_path, df, cache_dir=cache_dir)
+
+    warm, _ = read_workbook(file_path, cache_dir)
+    cold, _ = read_workbook(file_path, cache_dir, use_cache=False)
+    assert warm.dtypes.to_dict() == cold.dtypes.to_dict()
+    pd.testing.assert_frame_equal(warm, cold)
+    assert cold['MaSo'].tolist() == [1, 2]
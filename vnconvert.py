@@ -1,5 +1,33 @@
 import csv
+import hashlib
+import io
+import json
+import mmap
+import os
 import re
+import unicodedata
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+
+# Size of the byte ranges handed to each worker by transcode_csv
+CSV_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Number of distinct values (or CSV records) looked at when detecting a charset
+DETECT_SAMPLE_SIZE = 500
+
+# Character each byte turns into when UTF-8 text is wrongly decoded as Windows-1252
+# (the five bytes undefined in cp1252 pass through as Latin-1)
+_CP1252_BYTES = {}
+for _byte in range(256):
+    try:
+        _CP1252_BYTES[bytes([_byte]).decode('cp1252')] = _byte
+    except UnicodeDecodeError:
+        _CP1252_BYTES[chr(_byte)] = _byte
+_UTF8_TRAIL = ''.join(char for char, byte in _CP1252_BYTES.items() if 0x80 <= byte < 0xC0)
+_MOJIBAKE = re.compile('[%s]+' % re.escape(''.join(char for char, byte in _CP1252_BYTES.items() if byte >= 0x80)))
 
 # Define conversion patterns for different Vietnamese encodings
 patterns = {
@@ -10,19 +38,39 @@ patterns = {
     "VISCII"       : [r'\wß[½¾¶þ·Þ]|ð[áàÕäã¤í¢£ÆÇè©ë¨êª«®¬­íì¸ïîóò÷öõô¯°µ±²½¾¶þ·ÞúùøüûÑ×ñØ]', 0],
     "VPS_WIN"      : [r'\wÜ[Ö§©®ª«]|Ç[áàåäãÃí¢¥£¤èËÈëêÍíìÎÌïóòÕõôÓÒ¶°Ö§©®ª«úùøûÛÙØ¿º]', 0],
     "VIETWARE_F"   : [r'\w§[¥ìéíêë]|¢[ÀªÁ¶ºÊÛÂÆÃÄÌÑÍÎ£ÕÒÖÓÔÛØÜÙÚâßãàá¤çäèåæ¥ìéíêëòîóïñ÷ôøõ]', 0],
-    "VIETWARE_X"   : [r'[áãä][úöûøù]|à[õòûóô]|[åæ][ïìüíî]', re.IGNORECASE]
+    "VIETWARE_X"   : [r'[áãä][úöûøù]|à[õòûóô]|[åæ][ïìüíî]', re.IGNORECASE],
 # //		"BKHCM1"       : '/\wõ[ïðñôòó]|\s½[ÚÛÃÄÇÈÉÊÑÐíôóÒÓÔÕ]/u',
 # //		"BKHCM2"       : '/\w[êöï][ëìåíî]|úû[áâåãä]|ù[æçåèé]/iu',
 # //		"VNU"          : '/\wõ[çèéìêë]|\s½[?¡­¨¬µ¶·º¸¹¯°±´²³]/u',
-# //		"COMB_UNICODE" : '/[̣́̀̉̃]/iu',
-# //		"UTF8"         : '/(áº|á»)[¥¤§¦¬©¨«ª¯®±°·¶³²º½¼¾¿¡£¢]/ui',
+    "COMB_UNICODE" : [r'[\u0300\u0301\u0303\u0309\u0323]', re.IGNORECASE],
+    "UTF8"         : [r'(?:á[º»]|[ÃÄÅÆ])[%s]' % re.escape(_UTF8_TRAIL), 0],
 # //		"ESC_UNICODE"  : '/&#\d\d\d\d;/iu',
 }
 
+# Charsets that are only supported as a source: they are first turned into UNICODE
+#   COMB_UNICODE: tone marks stored as combining characters
+#   UTF8: UTF-8 bytes that were decoded as Windows-1252 ("Viá»‡t Nam")
+def fix_utf8_mojibake(text):
+    """Decode runs of UTF-8 bytes that were read as Windows-1252 back to Unicode, leaving other text as is."""
+    def decode(match):
+        try:
+            return bytes(_CP1252_BYTES[char] for char in match.group()).decode('utf-8')
+        except UnicodeDecodeError:
+            return match.group()
+    return _MOJIBAKE.sub(decode, text)
+
+SOURCE_ONLY_CHARSETS = {
+    "COMB_UNICODE" : lambda text: unicodedata.normalize("NFC", text),
+    "UTF8"         : fix_utf8_mojibake,
+}
+
 class Converter:
 
     """Convert qua lai giua mot so bang ma cua Vietnam"""
 
+    # Compiled engines shared by all instances: (source, target) -> function
+    _engines = {}
+
     def __init__(self):
         """Khoi tao"""
         self.TCVN3 = ["Aµ", "A¸", "¢" , "A·", "EÌ", "EÐ", "£" , "I×", "IÝ", "Oß",
@@ -152,20 +200,51 @@ class Converter:
         if(source_charset == None):
             source_charset = self.detectCharset(str_original)
 
+        # No known charset matches: the text has no Vietnamese diacritics to convert
         if(source_charset == None):
-            raise TypeError("Can not get charset of str_original")
+            return str_original
+
+        return self.getEngine(source_charset, target_charset)(str_original)
 
-        source_charset = getattr(self,source_charset)
-        target_charset = getattr(self,target_charset)
+    def getEngine(self, source_charset, target_charset = "UNICODE"):
+        """Tra ve ham convert mot chuoi tu source_charset sang target_charset (compile mot lan cho moi cap)"""
+        key = (source_charset, target_charset)
+        engine = self._engines.get(key)
+        if engine is None:
+            if target_charset in SOURCE_ONLY_CHARSETS:
+                raise ValueError(f"{target_charset} is only supported as a source charset")
+            if source_charset in SOURCE_ONLY_CHARSETS:
+                engine = self._chainEngine(SOURCE_ONLY_CHARSETS[source_charset], target_charset)
+            else:
+                engine = self._compileEngine(getattr(self, source_charset), getattr(self, target_charset))
+            self._engines[key] = engine
+        return engine
 
-        map_length = len(source_charset)
-        for number in range(map_length):
-            str_original = str_original.replace(source_charset[number], "::" + str(number) + "::")
+    def _chainEngine(self, to_unicode, target_charset):
+        if target_charset == "UNICODE":
+            return to_unicode
+        from_unicode = self.getEngine("UNICODE", target_charset)
+        return lambda text: from_unicode(to_unicode(text))
 
-        for number in range(map_length):
-            str_original = str_original.replace("::" + str(number) + "::", target_charset[number])
+    @staticmethod
+    def _compileEngine(source_table, target_table):
+        # Replacing the entries one after another in table order means an entry
+        # containing an earlier one (e.g. VNI "ÔÙ" after "Ô") can never match.
+        # Drop those; trying the rest in table order at each position then gives
+        # the same result in a single left-to-right pass.
+        lookup = {}
+        for number, source in enumerate(source_table):
+            if any(earlier in source for earlier in lookup):
+                continue
+            lookup[source] = target_table[number]
 
-        return str_original
+        # Single-character tables only need str.translate
+        if all(len(source) == 1 for source in lookup):
+            table = str.maketrans(lookup)
+            return lambda text: text.translate(table)
+
+        regex = re.compile("|".join(re.escape(source) for source in lookup))
+        return lambda text: regex.sub(lambda match: lookup[match.group()], text)
 
     def detectCharset(self, str_input):
         for pattern in patterns:
@@ -175,9 +254,202 @@ class Converter:
         return None
 
 
-def convert_csv(input_file, output_file, from_encoding, to_encoding):
-    """Convert Vietnamese text in a CSV file from one encoding to another."""
+# Verdicts of detect_file_charset, keyed by the SHA-256 of the file content
+_file_charsets = {}
+
+def _spread(values, count):
+    """At most count values, evenly spaced over the list."""
+    if count <= 0:
+        return []
+    return values[::max(1, len(values) // count)][:count]
+
+def detect_sample(values, sample_size=DETECT_SAMPLE_SIZE):
+    """Detect the charset of a collection of strings from a sample of its distinct values.
+
+    Returns (charset, confidence), where confidence is the share of the sampled values
+    matching any pattern that agree with the chosen charset. Returns (None, 0.0) when
+    nothing matches, i.e. the values carry no diacritics and need no conversion.
+    """
+    distinct = list(dict.fromkeys(value for value in values if isinstance(value, str)))
+
+    # Plain ASCII values only matter for VIQR, so sample the others first and fill the
+    # rest of the sample with ASCII values only when there are not enough of them
+    sample = _spread([value for value in distinct if not value.isascii()], sample_size)
+    sample += _spread([value for value in distinct if value.isascii()], sample_size - len(sample))
+
     converter = Converter()
+    votes = Counter(converter.detectCharset(value) for value in sample)
+    votes.pop(None, None)
+    if not votes:
+        return None, 0.0
+
+    charset, count = votes.most_common(1)[0]
+    return charset, count / sum(votes.values())
+
+def detect_column_charsets(df, sample_size=DETECT_SAMPLE_SIZE):
+    """Detect the charset of every text column of a DataFrame: {column: (charset, confidence)}."""
+    return {col: detect_sample(df[col].unique(), sample_size)
+            for col in df.columns
+            if pd.api.types.is_object_dtype(df[col].dtype) or pd.api.types.is_string_dtype(df[col].dtype)}
+
+def file_hash(file_path, block_size=1024 * 1024):
+    """SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def detect_file_charset(input_file, sample_size=DETECT_SAMPLE_SIZE, cache_file=None):
+    """Detect the charset of a CSV file from the cells of its first sample_size records.
+
+    The verdict is cached by content hash, in memory and, if cache_file is given, in
+    that JSON file so later runs on the same file skip detection.
+    """
+    key = file_hash(input_file)
+    if cache_file and key not in _file_charsets and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                _file_charsets.update({k: tuple(v) for k, v in json.load(f).items()})
+        except (OSError, ValueError) as e:
+            print(f"An error occurred while loading the charset cache: {e}")
+
+    if key in _file_charsets:
+        return _file_charsets[key]
+
+    with open(input_file, 'r', encoding='utf-8', newline='') as infile:
+        reader = csv.reader(infile)
+        cells = [cell for _, row in zip(range(sample_size), reader) for cell in row]
+    verdict = _file_charsets[key] = detect_sample(cells, sample_size)
+
+    if cache_file:
+        try:
+            with open(cache_file, 'w', encoding='utf-8') as f:
+                json.dump(_file_charsets, f)
+        except OSError as e:
+            print(f"An error occurred while saving the charset cache: {e}")
+    return verdict
+
+def apply_unique(series, func):
+    """Apply func to the distinct str values of a Series only and map the results back to every row.
+
+    Numeric, datetime and other non-text columns are returned unchanged, as are
+    non-str values (NaN, numbers, timestamps) inside object columns.
+    """
+    if not (pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype)):
+        return series
+
+    codes, uniques = pd.factorize(series)
+    converted = np.array([func(value) if isinstance(value, str) else value for value in uniques], dtype=object)
+    if len(converted) == 0:
+        return series
+
+    # Missing values have code -1 and keep their original value
+    values = np.where(codes >= 0, converted.take(codes), series.to_numpy(dtype=object))
+    return pd.Series(values, index=series.index, name=series.name, dtype=series.dtype)
+
+def apply_unique_columns(df, func, columns=None):
+    """Apply func column by column to a DataFrame, converting each distinct text value once."""
+    df = df.copy()
+    for col in (df.columns if columns is None else columns):
+        df[col] = apply_unique(df[col], func)
+    return df
+
+def convert_series(series, source_charset = None, target_charset = "UNICODE"):
+    """Convert the text values of a pandas Series from source_charset to target_charset.
+
+    Without source_charset the charset is detected once on a sample of the column.
+    """
+    if source_charset is None:
+        source_charset, _ = detect_sample(series.unique())
+    if source_charset is None or source_charset == target_charset:
+        return series
+    return apply_unique(series, Converter().getEngine(source_charset, target_charset))
+
+def convert_dataframe(df, source_charset = None, target_charset = "UNICODE", columns=None):
+    """Convert the text columns of a pandas DataFrame from source_charset to target_charset.
+
+    Without source_charset each column gets its own charset, detected on a sample.
+    """
+    df = df.copy()
+    for col in (df.columns if columns is None else columns):
+        df[col] = convert_series(df[col], source_charset, target_charset)
+    return df
+
+def csv_chunks(mm, chunk_size=CSV_CHUNK_SIZE):
+    """Yield (start, end) byte ranges of roughly chunk_size that end on a record boundary.
+
+    A newline only ends a record when it is outside quotes, i.e. when the number of
+    quote characters since the start of the range is even. Doubled quotes inside a
+    field count twice, so they do not change the parity.
+    """
+    size = len(mm)
+    start = 0
+    while start < size:
+        end = min(start + chunk_size, size)
+        quotes = mm[start:end].count(b'"')
+        while end < size:
+            newline = mm.find(b'\n', end)
+            if newline == -1:
+                end = size
+                break
+            quotes += mm[end:newline + 1].count(b'"')
+            end = newline + 1
+            if quotes % 2 == 0:
+                break
+        yield start, end
+        start = end
+
+def transcode_csv_chunk(input_file, start, end, convert_cell):
+    """Convert every cell of the records in bytes [start, end) of input_file and return the CSV bytes."""
+    with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode('utf-8')
+
+    outfile = io.StringIO(newline='')
+    writer = csv.writer(outfile)
+    for row in csv.reader(io.StringIO(text, newline='')):
+        writer.writerow([convert_cell(cell) for cell in row])
+    return outfile.getvalue().encode('utf-8')
+
+def transcode_csv(input_file, output_file, convert_cell, workers=None, chunk_size=CSV_CHUNK_SIZE):
+    """Convert a CSV file of any size in a process pool, writing the chunks back in their original order.
+
+    convert_cell must be picklable (a module-level function or a partial of one).
+    At most two chunks per worker are in flight, so memory use does not grow with the file size.
+    """
+    workers = workers or os.cpu_count()
+    with open(output_file, 'wb') as outfile, open(input_file, 'rb') as infile:
+        if os.fstat(infile.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+             ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for start, end in csv_chunks(mm, chunk_size):
+                pending.append(executor.submit(transcode_csv_chunk, input_file, start, end, convert_cell))
+                if len(pending) >= 2 * workers:
+                    outfile.write(pending.popleft().result())
+            while pending:
+                outfile.write(pending.popleft().result())
+
+def convert_csv(input_file, output_file, from_encoding, to_encoding, workers=1):
+    """Convert Vietnamese text in a CSV file from one encoding to another.
+
+    With workers other than 1 the file is transcoded in parallel chunks (0 or None: one worker per CPU).
+    """
+    converter = Converter()
+    # Detect the charset once for the whole file instead of for every cell
+    if from_encoding is None:
+        from_encoding, confidence = detect_file_charset(input_file)
+        print(f"Detected charset: {from_encoding} (confidence {confidence:.0%})")
+        if from_encoding is None:
+            from_encoding = to_encoding
+
+    if workers != 1:
+        convert_cell = partial(converter.convert, source_charset=from_encoding, target_charset=to_encoding)
+        transcode_csv(input_file, output_file, convert_cell, workers)
+        return
+
     with open(input_file, 'r', encoding='utf-8') as infile, open(output_file, 'w', newline='', encoding='utf-8') as outfile:
         reader = csv.reader(infile)
         writer = csv.writer(outfile)
@@ -192,13 +464,15 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert Vietnamese text in a CSV file between different encodings.")
     parser.add_argument('input_file', help="The input CSV file.")
     parser.add_argument('output_file', help="The output CSV file.")
-    parser.add_argument('from_encoding', help="The encoding of the input text.")
+    parser.add_argument('from_encoding', help="The encoding of the input text, or AUTO to detect it.")
     parser.add_argument('to_encoding', help="The encoding to convert the text to.")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes (0: one per CPU).")
     
     args = parser.parse_args()
 
     try:
-        convert_csv(args.input_file, args.output_file, args.from_encoding, args.to_encoding)
+        from_encoding = None if args.from_encoding.upper() == 'AUTO' else args.from_encoding
+        convert_csv(args.input_file, args.output_file, from_encoding, args.to_encoding, args.workers)
         print(f"Conversion complete. Check the output file: {args.output_file}")
     except ValueError as e:
         print(f"Error: {e}")
\ No newline at end of file
@@ -2,6 +2,7 @@ import csv
 import re
 import os
 import sys
+from vnconvert import apply_unique, apply_unique_columns, transcode_csv
 
 def vni2unicode(text):
     # Define the lists of Unicode and VNI characters
@@ -44,8 +45,22 @@ def vni2unicode(text):
 
     return text
 
-def convert_csv_vni_to_unicode(input_csv):
+def vni2unicode_series(series):
+    """Convert a pandas Series from VNI to Unicode, converting each distinct value only once."""
+    return apply_unique(series, vni2unicode)
+
+def vni2unicode_dataframe(df, columns=None):
+    """Convert the text columns of a pandas DataFrame from VNI to Unicode."""
+    return apply_unique_columns(df, vni2unicode, columns)
+
+def convert_csv_vni_to_unicode(input_csv, workers=1):
     output_csv = os.path.splitext(input_csv)[0] + '_unicode.csv'
+
+    # Stream the file through a process pool in record-aligned chunks
+    if workers != 1:
+        transcode_csv(input_csv, output_csv, vni2unicode, workers)
+        print(f"Converted file saved as {output_csv}")
+        return
     
     with open(input_csv, mode='r', newline='', encoding='utf-8') as infile, \
          open(output_csv, mode='w', newline='', encoding='utf-8') as outfile:
@@ -61,9 +76,10 @@ def convert_csv_vni_to_unicode(input_csv):
     print(f"Converted file saved as {output_csv}")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python convert_csv_vni_to_unicode.py <input_csv>")
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python convert_csv_vni_to_unicode.py <input_csv> [workers]")
         sys.exit(1)
 
     input_csv = sys.argv[1]
-    convert_csv_vni_to_unicode(input_csv)
+    workers = int(sys.argv[2]) if len(sys.argv) == 3 else 1
+    convert_csv_vni_to_unicode(input_csv, workers)
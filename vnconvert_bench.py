@@ -0,0 +1,129 @@
+# Benchmark and equivalence check for the Vietnamese charset converters
+# Synthetic case names and addresses are encoded from Unicode into every charset,
+# then decoded back by each implementation:
+#   baseline           : the original two-pass str.replace loop of vnconvert.Converter (kept here, frozen)
+#   Converter          : vnconvert.Converter with its compiled engines
+#   convert_series     : vnconvert.convert_series on a pandas column (distinct values only)
+#   vnconvert2         : vnconvert2.vni2unicode (VNI_WIN only)
+#   xls2geojson        : xls2geojson.vni2unicode (VNI_WIN only)
+# For each one it reports throughput (cells/s and MB/s of UTF-8 input), peak memory,
+# the number of outputs that differ from the baseline and the number of cells that
+# do not round-trip back to the original Unicode text.
+# The exit status is 1 when Converter disagrees with the baseline, so a faster engine
+# can only be accepted if it produces exactly the same output.
+
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+import pandas as pd
+import vnconvert
+import vnconvert2
+
+CHARSETS = ["UNICODE", "TCVN3", "VNI_WIN", "VIQR", "VISCII", "VPS_WIN", "VIETWARE_F", "VIETWARE_X"]
+
+FAMILY_NAMES = ["Nguyễn", "Trần", "Lê", "Phạm", "Huỳnh", "Hoàng", "Võ", "Đặng", "Bùi", "Đỗ", "Hồ", "Ngô", "Dương", "Lý"]
+MIDDLE_NAMES = ["Văn", "Thị", "Hữu", "Đức", "Minh", "Ngọc", "Thanh", "Quốc", "Kim", "Xuân"]
+GIVEN_NAMES = ["Anh", "Bảo", "Cường", "Dũng", "Hằng", "Hiếu", "Hương", "Khoa", "Lộc", "Mỹ", "Nguyệt", "Phước",
+               "Quyên", "Sơn", "Thảo", "Tuấn", "Uyên", "Việt", "Xuyến", "Yến"]
+HAMLETS = ["Ấp Bình Thạnh", "Ấp Mỹ Lợi", "Ấp Tân Hòa", "Khóm Phước Thới", "Ấp Đông Hưng", "Ấp Rạch Sỏi"]
+COMMUNES = ["Xã Mỹ Hòa", "Phường Châu Phú A", "Xã Hòa Bình", "Thị trấn Chợ Mới", "Xã Vĩnh Trạch", "Phường Tân Xuyên",
+            "Xã Long Hựu", "Xã Thới Thuận"]
+DISTRICTS = ["Huyện Chợ Mới", "Thành phố Long Xuyên", "Huyện Giá Rai", "Huyện Long Phú", "Huyện Cái Bè",
+             "Thị xã Ngã Bảy", "Huyện Đầm Dơi", "Huyện Trần Văn Thời"]
+PROVINCES = ["An Giang", "Hậu Giang", "Bạc Liêu", "Bến Tre", "Cần Thơ", "Cà Mau", "Đồng Tháp", "Kiên Giang",
+             "Long An", "Sóc Trăng", "Tiền Giang", "Trà Vinh", "Vĩnh Long"]
+DIAGNOSES = ["Sốt xuất huyết Dengue", "Sốt xuất huyết Dengue có dấu hiệu cảnh báo", "Sốt xuất huyết Dengue nặng"]
+
+def generate_cells(count, seed=0):
+    """Generate count Unicode cells shaped like a line listing: names, addresses and diagnoses."""
+    rnd = random.Random(seed)
+    cells = []
+    for _ in range(count):
+        kind = rnd.random()
+        if kind < 0.4:
+            cells.append(f"{rnd.choice(FAMILY_NAMES)} {rnd.choice(MIDDLE_NAMES)} {rnd.choice(GIVEN_NAMES)}")
+        elif kind < 0.85:
+            cells.append(f"{rnd.choice(HAMLETS)}, {rnd.choice(COMMUNES)}, {rnd.choice(DISTRICTS)}, {rnd.choice(PROVINCES)}")
+        else:
+            cells.append(rnd.choice(DIAGNOSES))
+    return cells
+
+def baseline_convert(source_table, target_table, text):
+    """The original Converter.convert loop: replace every entry by a placeholder, then by its target."""
+    for number in range(len(source_table)):
+        text = text.replace(source_table[number], "::" + str(number) + "::")
+    for number in range(len(source_table)):
+        text = text.replace("::" + str(number) + "::", target_table[number])
+    return text
+
+def implementations(converter, charset):
+    """Name -> function converting a list of cells in charset to a list of Unicode cells."""
+    source_table = getattr(converter, charset)
+    target_table = converter.UNICODE
+    engine = converter.getEngine(charset, "UNICODE")
+    found = {
+        "baseline": lambda cells: [baseline_convert(source_table, target_table, cell) for cell in cells],
+        "Converter": lambda cells: [engine(cell) for cell in cells],
+        "convert_series": lambda cells: vnconvert.convert_series(pd.Series(cells, dtype=object), charset).tolist(),
+    }
+    if charset == "VNI_WIN":
+        found["vnconvert2"] = lambda cells: [vnconvert2.vni2unicode(cell) for cell in cells]
+        try:
+            import xls2geojson
+            found["xls2geojson"] = lambda cells: [xls2geojson.vni2unicode(cell) for cell in cells]
+        except ImportError as e:
+            print(f"Skipping xls2geojson.vni2unicode: {e}")
+    return found
+
+def measure(func, cells, repeat):
+    """Return (outputs, best elapsed seconds, peak traced memory in bytes)."""
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = func(cells)
+        elapsed = min(elapsed, time.perf_counter() - start)
+
+    # Memory is traced in a separate run because tracemalloc slows everything down
+    tracemalloc.start()
+    func(cells)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return outputs, elapsed, peak
+
+def main(count, seed, repeat):
+    converter = vnconvert.Converter()
+    originals = generate_cells(count, seed)
+    from_unicode = {charset: converter.getEngine("UNICODE", charset) for charset in CHARSETS}
+
+    print(f"{'charset':<11} {'implementation':<15} {'cells/s':>11} {'MB/s':>8} {'peak KiB':>9} {'!=baseline':>10} {'!=roundtrip':>11}")
+    disagreements = 0
+    for charset in CHARSETS:
+        cells = [from_unicode[charset](cell) for cell in originals]
+        megabytes = sum(len(cell.encode('utf-8')) for cell in cells) / 1e6
+        baseline = None
+        for name, func in implementations(converter, charset).items():
+            outputs, elapsed, peak = measure(func, cells, repeat)
+            if baseline is None:
+                baseline = outputs
+            differ = sum(output != expected for output, expected in zip(outputs, baseline))
+            not_round_trip = sum(output != original for output, original in zip(outputs, originals))
+            if name in ("Converter", "convert_series"):
+                disagreements += differ
+            print(f"{charset:<11} {name:<15} {count / elapsed:>11,.0f} {megabytes / elapsed:>8.2f} {peak / 1024:>9,.0f} {differ:>10} {not_round_trip:>11}")
+
+    if disagreements:
+        print(f"\nFAILED: the compiled engines differ from the baseline on {disagreements} cells")
+        return 1
+    print("\nThe compiled engines match the baseline on every charset")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Vietnamese charset converters and check they agree.")
+    parser.add_argument('--cells', type=int, default=20000, help="Number of synthetic cells per charset.")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for the synthetic data.")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per implementation (the best one is reported).")
+    args = parser.parse_args()
+
+    sys.exit(main(args.cells, args.seed, args.repeat))
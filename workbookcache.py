@@ -0,0 +1,122 @@
+# Cache of parsed Excel workbooks, shared by xls2csv.py and xls2geojson.py
+# pd.read_excel is the slowest step of a rerun over the casedata folder, so the first sheet
+# of each workbook is parsed once and stored in a cache folder (ED_WORKBOOK_CACHE, or
+# .workbook_cache next to the workbooks) under the SHA-256 of the workbook's content. Later
+# runs memory-map the Feather file instead of parsing the XLSX again; a workbook whose
+# content changed gets a new key, and the entry of its old content is removed.
+# Sheets Arrow cannot store (object columns mixing datetimes, numbers and strings, as old
+# line listings often do) are pickled instead, which still avoids the XLSX parse.
+# save_frame and load_frame are the storage of the entries, also used by pipeline.py.
+# write_workbook saves a DataFrame back to its workbook and caches the sheet parsed from the
+# new content, so rewriting a workbook (as xls2geojson.py does to mark its rows) keeps the
+# next run warm. The parsed sheet is cached rather than the DataFrame: the dtypes of a sheet
+# read back can differ from the frame written (a float column without its NaN reads as int).
+
+import json
+import os
+import pickle
+import pandas as pd
+from vnconvert import file_hash
+
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError:
+    pa = feather = None
+
+# Name of the cache folder created next to the workbooks when ED_WORKBOOK_CACHE is not set
+CACHE_FOLDER_NAME = '.workbook_cache'
+
+# Schema metadata key holding the metadata of an entry (such as the sheet name) in the Feather files
+METADATA_KEY = b'ed_metadata'
+
+def cache_folder(file_path, cache_dir=None):
+    """The cache folder of a workbook: cache_dir, ED_WORKBOOK_CACHE or the default next to the workbook."""
+    return cache_dir or os.environ.get('ED_WORKBOOK_CACHE') or os.path.join(os.path.dirname(file_path), CACHE_FOLDER_NAME)
+
+def _entry_prefix(file_path):
+    return os.path.basename(file_path) + '.'
+
+def _parse(file_path):
+    """Parse the first sheet, opening the workbook once for both the sheet name and the data."""
+    with pd.ExcelFile(file_path) as excel_file:
+        sheet_name = excel_file.sheet_names[0]
+        return excel_file.parse(sheet_name), sheet_name
+
+def load_frame(base):
+    """Return (df, metadata) of the entry saved as base (without extension), or None if there is none."""
+    for extension in ('.feather', '.pkl'):
+        entry = base + extension
+        if not os.path.exists(entry) or (extension == '.feather' and feather is None):
+            continue
+        try:
+            if extension == '.feather':
+                table = feather.read_table(entry, memory_map=True)
+                metadata = json.loads((table.schema.metadata or {}).get(METADATA_KEY, b'{}'))
+                return table.to_pandas(), metadata
+            with open(entry, 'rb') as f:
+                cached = pickle.load(f)
+            return cached['df'], cached['metadata']
+        except Exception as e:
+            print(f"Ignoring unreadable cache entry {entry}: {e}")
+    return None
+
+def save_frame(base, df, metadata=None, prefix=None):
+    """Save df (and a JSON-able metadata dict) as base.feather, or base.pkl if Arrow cannot store it.
+
+    The other entries of the folder whose name is prefix followed by a key and an extension
+    (older versions of the same data) are removed. Returns the path of the entry.
+    """
+    folder = os.path.dirname(base) or '.'
+    os.makedirs(folder, exist_ok=True)
+    metadata = metadata or {}
+    entry = None
+    if feather is not None:
+        entry = base + '.feather'
+        try:
+            table = pa.Table.from_pandas(df)
+            schema_metadata = dict(table.schema.metadata or {})
+            schema_metadata[METADATA_KEY] = json.dumps(metadata, ensure_ascii=False).encode('utf-8')
+            # Uncompressed, so it can be memory-mapped
+            feather.write_feather(table.replace_schema_metadata(schema_metadata), entry + '.tmp', compression='uncompressed')
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            if os.path.exists(entry + '.tmp'):
+                os.remove(entry + '.tmp')
+            entry = None
+    if entry is None:
+        entry = base + '.pkl'
+        with open(entry + '.tmp', 'wb') as f:
+            pickle.dump({'df': df, 'metadata': metadata}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(entry + '.tmp', entry)
+
+    if prefix:
+        for name in os.listdir(folder):
+            if name.startswith(prefix) and os.path.join(folder, name) != entry and name[len(prefix):].count('.') == 1:
+                os.remove(os.path.join(folder, name))
+    return entry
+
+def write_workbook(file_path, df, sheet_name='Sheet1', cache_dir=None, use_cache=True):
+    """Write df (without its index) as the only sheet of a workbook, and cache the sheet parsed back from it."""
+    df.to_excel(file_path, sheet_name=sheet_name, index=False)
+    if use_cache:
+        read_workbook(file_path, cache_dir)
+
+def read_workbook(file_path, cache_dir=None, use_cache=True):
+    """Return (df, sheet_name) of the first sheet of a workbook, from the cache when its content was parsed before."""
+    if not use_cache:
+        return _parse(file_path)
+
+    prefix = _entry_prefix(file_path)
+    base = os.path.join(cache_folder(file_path, cache_dir), prefix + file_hash(file_path))
+    cached = load_frame(base)
+    # An entry without its sheet name (written by an older version) is parsed again
+    if cached is not None and 'sheet_name' in cached[1]:
+        return cached[0], cached[1]['sheet_name']
+
+    df, sheet_name = _parse(file_path)
+    try:
+        # The entries of older contents of the workbook are removed
+        save_frame(base, df, {'sheet_name': sheet_name}, prefix=prefix)
+    except OSError as e:
+        print(f"Could not cache {file_path}: {e}")
+    return df, sheet_name
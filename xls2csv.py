@@ -1,20 +1,26 @@
 import os
-import pandas as pd
 import glob
-import time
 import signal
 import random
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
 import argparse
-
-# Configurable rate limit
+from functools import partial
+from geocache import GeoCache, DEFAULT_CACHE_FILE, DEFAULT_FAILURE_TTL
+from address import split_address, geocode_unique
+from geocoder import GeocodingEngine
+from gazetteer import load_gazetteer, DEFAULT_GAZETTEER_FILE
+from journal import Journal
+from vnconvert import file_hash
+from workbookcache import read_workbook
+from parallel import DEFAULT_PROCESSES, WorkerPool
+
+# Configurable rate limit and number of concurrent requests
 rate_limit_per_second = 1
+workers = 4
 
 agent_name = "edgcoder_" + str(random.randint(1, 100))
 
-# Initialize geolocator with user_agent
-geolocator = Nominatim(user_agent=agent_name)
+# Initialize the geocoding engine (one shared geolocator and rate limiter) with user_agent
+geocoding_engine = GeocodingEngine(rate_limit_per_second, workers, user_agent=agent_name)
 
 # Initialize success and fail counters
 success_count = 0
@@ -23,92 +29,90 @@ fail_count = 0
 # Flag to handle graceful shutdown
 stop_flag = False
 
-def geocode_address(address):
-    try:
-        location = geolocator.geocode(address, timeout=10)
-        if location:
-            return location.latitude, location.longitude
-        else:
-            return 'NA', 'NA'
-    except GeocoderTimedOut:
-        return 'NA', 'NA'
+# Geocode cache shared with the other geocoders, opened in process_excel_files
+geocache = None
 
 def signal_handler(sig, frame):
     global stop_flag
     stop_flag = True
+    geocoding_engine.cancel()
     print("\nGracefully stopping the script. Please wait...")
 
 signal.signal(signal.SIGINT, signal_handler)
 
-def process_excel_files(folder_path):
-    global success_count, fail_count, stop_flag
+def load_workbook(file, workbook_cache=None, use_workbook_cache=True):
+    """Load the first sheet of a workbook with its 'address' column (run in a worker process)."""
+    # Load the first sheet of the Excel file and its name, parsed once per workbook content
+    df, first_sheet_name = read_workbook(file, workbook_cache, use_workbook_cache)
+
+    # Combine columns 1, 2, 3, and 4 into a new 'address' column
+    #df['address'] = df.iloc[:, 1].astype(str) + ',' + df.iloc[:, 2].astype(str) + ',' + df.iloc[:, 3].astype(str)
+    df['address'] = df.iloc[:, 2].astype(str) + ',' + df.iloc[:, 3].astype(str)
+
+    # Concatenate the spreadsheet name to the 'address' column
+    df['address'] = df['address'] + ',' + first_sheet_name + ',Việt Nam'
+
+    # Drop the original columns 1-4
+    df.drop(df.columns[1:5], axis=1, inplace=True)
+    return df
+
+def process_excel_files(folder_path, cache_file=DEFAULT_CACHE_FILE, gazetteer_file=DEFAULT_GAZETTEER_FILE,
+                        failure_ttl=DEFAULT_FAILURE_TTL, retry_failures=False, workbook_cache=None, use_workbook_cache=True,
+                        processes=DEFAULT_PROCESSES):
+    global success_count, fail_count, stop_flag, geocache
+
+    # Addresses that failed within failure_ttl seconds are skipped unless retry_failures is set
+    geocache = GeoCache(cache_file, failure_ttl=failure_ttl, retry_failures=retry_failures)
+    gazetteer = load_gazetteer(gazetteer_file)
     
-    # Get all Excel files starting with 'ED_'
-    file_list = glob.glob(os.path.join(folder_path, 'ed_*.xlsx'))
+    # Get all Excel files starting with 'ED_', in name order
+    file_list = sorted(glob.glob(os.path.join(folder_path, 'ed_*.xlsx')))
+
+    # Workbooks finished by an interrupted run are skipped, unless their content changed since
+    journal = Journal(os.path.join(folder_path, 'xls2csv.journal.jsonl'), batch_size=1)
+    done = {(record['workbook'], record['hash']) for record in journal.records}
 
+    pending = []
     for file in file_list:
+        workbook_hash = file_hash(file)
+        if (os.path.basename(file), workbook_hash) in done:
+            print(f"Skipping {file}: already processed")
+        else:
+            pending.append((file, workbook_hash))
+
+    # The workbooks are parsed in worker processes (when processes > 1) while this process
+    # geocodes and saves them one at a time, in name order
+    pool = WorkerPool(processes)
+    load = partial(load_workbook, workbook_cache=workbook_cache, use_workbook_cache=use_workbook_cache)
+    for (file, workbook_hash), df in zip(pending, pool.imap(load, [file for file, _ in pending])):
         if stop_flag:
             break
 
-        # Load the Excel file to get the sheet names
-        excel_file = pd.ExcelFile(file)
-        # Get the name of the first sheet
-        first_sheet_name = excel_file.sheet_names[0]
-
-        # Load the first sheet of the Excel file
-        df = pd.read_excel(file, sheet_name=first_sheet_name)
-       
-        # Combine columns 1, 2, 3, and 4 into a new 'address' column
-        #df['address'] = df.iloc[:, 1].astype(str) + ',' + df.iloc[:, 2].astype(str) + ',' + df.iloc[:, 3].astype(str)
-        df['address'] = df.iloc[:, 2].astype(str) + ',' + df.iloc[:, 3].astype(str)
-        
-        # Concatenate the spreadsheet name to the 'address' column    
-        df['address'] = df['address'] + ',' + first_sheet_name + ',Việt Nam'
-        
-        # Drop the original columns 1-4
-        df.drop(df.columns[1:5], axis=1, inplace=True)
-
         # Replace spaces in the new file name with underscores
         spreadsheet_name = os.path.splitext(os.path.basename(file))[0]
         new_file_name = os.path.join(folder_path, spreadsheet_name.replace(' ', '_') + '.csv')
 
-        # Initialize latitude and longitude columns
-        df['latitude'] = 'NA'
-        df['longitude'] = 'NA'
-
-        # Iterate over rows in the DataFrame
-        for index in range(len(df)):
-            if stop_flag:
-                break
-            address = df.at[index, 'address']
-            lat, lon = geocode_address(address)
-
-            df.at[index, 'latitude'] = lat
-            df.at[index, 'longitude'] = lon
-
-            #print(f"\rProcessing {address}: {lat}: {lon} ")
-
-            if lat != 'NA' and lon != 'NA':
-                success_count += 1
-            else:
-                fail_count += 1
-                
-            print(f"\rProcessing {file}: {index + 1}/{len(df)}: {success_count} successful, {fail_count} failed", end='')
-            time.sleep(1 / rate_limit_per_second)  # Rate limiting
-
-            # Save state periodically
-            if index % 10 == 0:
-                try:
-                    df.to_csv(new_file_name, index=False)
-                except Exception as e:
-                    print(f"\nError saving state file: {e}")
-                    return
+        # Geocode each distinct address once (falling back to its less specific levels)
+        # and broadcast the result to all its rows; addresses missing from both the cache
+        # and the gazetteer are geocoded concurrently under the engine's rate limit
+        print(f"\rProcessing {file}: {len(df)} rows, {df['address'].nunique()} distinct addresses", end='')
+        geocoded = geocode_unique(df, ['address'], split_address, geocoding_engine.geocode, geocache,
+                                  should_stop=lambda: stop_flag, mapper=geocoding_engine.map, gazetteer=gazetteer)
+
+        # Unresolved addresses keep 'NA' in the latitude, longitude and level columns
+        resolved = geocoded['latitude'].notna()
+        df['latitude'] = geocoded['latitude'].where(resolved, 'NA')
+        df['longitude'] = geocoded['longitude'].where(resolved, 'NA')
+        df['geocode_level'] = geocoded['geocode_level'].where(resolved, 'NA')
+        success_count += int(resolved.sum())
+        fail_count += int((~resolved).sum())
 
         # Save final state
         try:
             df.to_csv(new_file_name, index=False)
         except Exception as e:
             print(f"\nError saving final state: {e}")
+            pool.close()
             return
 
         # Save the successful geocoded data to a new CSV
@@ -122,14 +126,39 @@ def process_excel_files(folder_path):
 
         except Exception as e:
             print(f"\nError saving geocoded addresses: {e}")
+            pool.close()
             return
 
         # Print the final counts
         print(f"\nFinished processing {file}: {success_count} successful, {fail_count} failed")
+        if not stop_flag:
+            journal.append({'workbook': os.path.basename(file), 'hash': workbook_hash})
+    pool.close()
+
+    # The journal is only needed to resume an interrupted run
+    if stop_flag:
+        journal.close()
+    else:
+        journal.remove()
+
+    # Report every address that failed to geocode, with its reason, so it can be fixed by hand
+    failures_file_name = os.path.join(folder_path, 'geocode_failures.csv')
+    try:
+        print(f"{geocache.export_failures(failures_file_name)} recorded failures saved to {failures_file_name}")
+    except Exception as e:
+        print(f"\nError saving the failure report: {e}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process Excel files, geocode addresses, and save the results.")
     parser.add_argument('folder_path', nargs='?', default='./', help="The folder path containing the Excel files.")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_FILE, help="The geocode cache database shared by all geocoders.")
+    parser.add_argument('--gazetteer', default=DEFAULT_GAZETTEER_FILE, help="The level-3 boundary GeoJSON used to geocode communes offline.")
+    parser.add_argument('--failure-ttl', type=float, default=DEFAULT_FAILURE_TTL / 86400, help="Days before an address that failed to geocode is tried again.")
+    parser.add_argument('--retry-failed', action='store_true', help="Try again the addresses that failed, even before their TTL expires.")
+    parser.add_argument('--workbook-cache', default=None, help="Folder of the parsed workbook cache (default: ED_WORKBOOK_CACHE or .workbook_cache in the folder).")
+    parser.add_argument('--no-workbook-cache', action='store_true', help="Parse every workbook again instead of using the cache.")
+    parser.add_argument('--processes', type=int, default=DEFAULT_PROCESSES, help="Worker processes parsing the workbooks (0: one per CPU, default: ED_PROCESSES or 1).")
     args = parser.parse_args()
 
-    process_excel_files(args.folder_path)
+    process_excel_files(args.folder_path, args.cache, args.gazetteer, args.failure_ttl * 86400, args.retry_failed,
+                        args.workbook_cache, not args.no_workbook_cache, args.processes)